@@ -2,12 +2,24 @@
 Anthropic support for golem
 """
 
-from util import http_request, fatal, lookup_variable
-
-# pylint: disable=broad-exception-caught, too-many-arguments
-
-
-def ask_anthropic(model, url, api_key, messages, temperature, top_p, max_tokens):
+from registry import DEFAULT_MODELS
+from util import http_request, fatal, GolemError, lookup_variable
+from timing import phase
+
+# pylint: disable=broad-exception-caught, too-many-arguments, too-many-locals
+
+
+def ask_anthropic(
+    model,
+    url,
+    api_key,
+    messages,
+    temperature,
+    top_p,
+    max_tokens,
+    timeout=None,
+    timeout_ceiling=None,
+):
     """
     Make a request to the Anthropic API.
     """
@@ -16,7 +28,7 @@ def ask_anthropic(model, url, api_key, messages, temperature, top_p, max_tokens)
     # No support for seed or logprobs as at July 204.
 
     if model is None:
-        model = "claude-3-5-sonnet-20240620"
+        model = DEFAULT_MODELS["anthropic"]  # Default
 
     if url is None:
         url = "https://api.anthropic.com/v1/messages"
@@ -56,11 +68,20 @@ def ask_anthropic(model, url, api_key, messages, temperature, top_p, max_tokens)
     request = None
     response = None
     try:
-        request, response = http_request(url, headers, json_data)
-        response = response.json()
+        request, response = http_request(
+            url,
+            headers,
+            json_data,
+            timeout=timeout,
+            timeout_ceiling=timeout_ceiling,
+        )
+        with phase("decode"):
+            response = response.json()
         answer = response["content"][0]["text"]
         provider = "anthropic"
         model = response["model"]
+    except GolemError:
+        raise
     except Exception as e:
         fatal(f"EXCEPTION: {e} REQUEST: {request} RESPONSE: {response}")
 
@@ -4,7 +4,9 @@ Azure OpenAI support for golem.
 
 # pylint: disable=broad-exception-caught, too-many-arguments, too-many-locals
 
-from util import http_request, fatal, lookup_variable
+from registry import DEFAULT_MODELS
+from util import http_request, fatal, GolemError, lookup_variable
+from timing import phase
 
 # See
 # https://learn.microsoft.com/en-us/azure/ai-services/openai/reference
@@ -29,6 +31,8 @@ def ask_azure(
     logprobs,
     top_logprobs,
     reasoning_effort,
+    timeout=None,
+    timeout_ceiling=None,
 ):
     """
     Make a request to the Azure OpenAI API.
@@ -45,7 +49,7 @@ def ask_azure(
     # name.
 
     if model is None:
-        model = "gpt-4o-2024-05-13"  # Default
+        model = DEFAULT_MODELS["azure"]  # Default
 
     model = model.replace(".", "")  # N.B. Microsoft uses gpt-35-turbo not gpt-3.5-turbo
 
@@ -82,11 +86,20 @@ def ask_azure(
     request = None
     response = None
     try:
-        request, response = http_request(url, headers, json_data)
-        response = response.json()
+        request, response = http_request(
+            url,
+            headers,
+            json_data,
+            timeout=timeout,
+            timeout_ceiling=timeout_ceiling,
+        )
+        with phase("decode"):
+            response = response.json()
         answer = response["choices"][0]["message"]["content"]
         provider = "azure"
         model = response["model"]
+    except GolemError:
+        raise
     except Exception as e:
         fatal(f"EXCEPTION: {e} REQUEST: {request} RESPONSE: {response}")
 
@@ -4,11 +4,22 @@ Azure AI support for golem
 
 # pylint: disable=broad-exception-caught, too-many-arguments, too-many-locals
 
-from util import http_request, fatal, lookup_variable
+from util import http_request, fatal, GolemError, lookup_variable
+from timing import phase
 
 
 def ask_azureai(
-    url, api_key, messages, temperature, seed, top_p, max_tokens, logprobs, top_logprobs
+    url,
+    api_key,
+    messages,
+    temperature,
+    seed,
+    top_p,
+    max_tokens,
+    logprobs,
+    top_logprobs,
+    timeout=None,
+    timeout_ceiling=None,
 ):
     """
     Make a request to the Azure AI Inference API.
@@ -54,11 +65,20 @@ def ask_azureai(
     request = None
     response = None
     try:
-        request, response = http_request(url, headers, json_data)
-        response = response.json()
+        request, response = http_request(
+            url,
+            headers,
+            json_data,
+            timeout=timeout,
+            timeout_ceiling=timeout_ceiling,
+        )
+        with phase("decode"):
+            response = response.json()
         answer = response["choices"][0]["message"]["content"]
         provider = "azureai"
         model = response["model"]
+    except GolemError:
+        raise
     except Exception as e:
         fatal(f"EXCEPTION: {e} REQUEST: {request} RESPONSE: {response}")
 
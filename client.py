@@ -0,0 +1,112 @@
+"""
+A Python API for golem, for programs that would otherwise run the
+golem command once per prompt or file.
+
+Example
+    from client import Client
+
+    client = Client(provider="openai", model="gpt-4o", concurrency=8)
+    result = client.ask("Why is the sky blue?", temperature=0)
+    for result in client.ask_many(prompts):
+        print(result["id"], result["answer"])
+
+Results are the same dictionaries that the golem command prints.
+Connections, credentials and the model registry are kept between
+calls. Errors raise util.GolemError rather than exiting.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import argparse
+
+from golem import make_parser, make_targets, run, throttle
+from util import POOL_SIZE, new_session, use_session
+
+# Per request parameters, as opposed to settings of the client
+REQUEST_FIELDS = ("id", "messages", "repeat", "temperature", "top_p")
+
+
+class Client:
+    """
+    A golem client for one provider and model. Keyword arguments are
+    golem's command line options, e.g., max_tokens=100, rpm=60, except
+    that system_prompt is the text of the system prompt.
+    """
+
+    def __init__(self, provider="ollama", model=None, concurrency=1, **options):
+        self.args = make_parser().parse_args([])
+        self.args.provider = provider
+        self.args.model = model
+        self.args.concurrency = concurrency
+        self.set_options(self.args, options)
+        self.target = make_targets(self.args)[0]
+        self.session = new_session(max(concurrency, POOL_SIZE))
+
+    @staticmethod
+    def set_options(args, options):
+        """
+        Set golem options on an argument namespace, rejecting unknown
+        options.
+        """
+        for name, value in options.items():
+            if not hasattr(args, name):
+                raise TypeError(f"Unknown golem option {name}")
+            setattr(args, name, value)
+
+    def ask(self, messages, **params):
+        """
+        Send one request and return its result. messages is a list of
+        chat messages or a prompt string. params may give the id,
+        repeat, temperature and top_p of the request, and override
+        other options, e.g., max_tokens.
+        """
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+
+        args = self.target["args"]
+        options = {k: v for k, v in params.items() if k not in REQUEST_FIELDS}
+        if options:
+            args = argparse.Namespace(**vars(args))
+            self.set_options(args, options)
+        if args.system_prompt:
+            messages = [{"role": "system", "content": args.system_prompt}] + list(messages)
+
+        throttle(self.target)
+        with use_session(self.session):
+            return run(
+                params.get("id", 1),
+                args,
+                params.get("repeat", 0),
+                params.get("temperature"),
+                params.get("top_p"),
+                messages,
+            )
+
+    def ask_one(self, request):
+        """
+        Send a request given as messages, a prompt string, or a
+        dictionary of messages and ask() parameters.
+        """
+        if isinstance(request, dict):
+            return self.ask(**request)
+        return self.ask(request)
+
+    def ask_many(self, requests):
+        """
+        Send many requests, up to concurrency at a time, and generate
+        their results in the order they complete. requests may be a
+        generator; it is consumed only as fast as requests can be sent.
+        """
+        concurrency = self.args.concurrency
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = set()
+            for request in requests:
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(executor.submit(self.ask_one, request))
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
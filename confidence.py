@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+"""
+Reads one or more answers.jsonl files, made with --logprobs, and
+reports confidence measures of each answer's tokens, per model,
+temperature and repeat (or other groups) as JSONL:
+
+    log_likelihood   sum of the token logprobs
+    perplexity       exp(-mean token logprob)
+    entropy          mean entropy (nats) of the top logprobs, renormalised
+    margin           mean logprob difference of the top two tokens
+
+entropy and margin need --top_logprobs (at least 2 for margin).
+Logprobs may be inline or in a --logprobs-file, which is memory
+mapped. With --answers, each answer's measures are reported instead,
+e.g., to join with scores for calibration.
+
+Examples
+./confidence.py answers.jsonl
+./confidence.py --group-by model,temperature -j 8 archive/*.jsonl
+./confidence.py --answers answers.jsonl > confidence.jsonl
+"""
+
+import argparse
+import json
+from multiprocessing import Pool
+import os
+
+import numpy as np
+import pandas as pd
+
+from jsonlindex import byte_ranges
+from latencies import parse_group_by, read_records
+from logprobs import layout
+
+MEASURES = ("log_likelihood", "perplexity", "entropy", "margin")
+
+
+def side_file(maps, pointer, directory):
+    """
+    Return a memory map of the side file that a pointer refers to,
+    opening each file once.
+    """
+    path = pointer["file"]
+    if directory is not None:
+        path = os.path.join(directory, os.path.basename(path))
+    if path not in maps:
+        maps[path] = np.memmap(path, dtype=np.uint8, mode="r")
+    return maps[path]
+
+
+def pointer_arrays(buffer, offset):
+    """
+    Return the logprobs and the top logprobs (tokens x k) of a block in
+    a side file, without copying.
+    """
+    n, k, values, top_values, _, _ = layout(buffer, offset)
+    logprobs = buffer[values : values + 4 * n].view("<f4")
+    top = buffer[top_values : top_values + 4 * n * k].view("<f4").reshape(n, k)
+    return logprobs, top
+
+
+def inline_arrays(content):
+    """
+    Return the logprobs and the top logprobs (tokens x k) of API style
+    logprobs content.
+    """
+    k = max((len(token.get("top_logprobs") or []) for token in content), default=0)
+    logprobs = np.array([token["logprob"] for token in content], dtype=np.float32)
+    top = np.full((len(content), k), np.nan, dtype=np.float32)
+    for i, token in enumerate(content):
+        alternatives = [t["logprob"] for t in token.get("top_logprobs") or []]
+        top[i, : len(alternatives)] = alternatives
+    return logprobs, top
+
+
+def choice_arrays(choice, maps, directory):
+    """
+    Return the logprobs and top logprobs of a choice, inline or in a
+    side file, which are empty if it has none.
+    """
+    data = choice.get("logprobs") or {}
+    if "offset" in data:
+        return pointer_arrays(side_file(maps, data, directory), data["offset"])
+    return inline_arrays(data.get("content") or [])
+
+
+def read_answers(path, group_by, directory, span):
+    """
+    Return the fields of each answer with logprobs in an answers file,
+    or a byte range of it, and their logprobs and top logprobs.
+    """
+    rows = []
+    values = []
+    tops = []
+    maps = {}
+    for record in read_records(path, span):
+        choices = (record.get("response") or {}).get("choices") or []
+        for choice in choices:
+            logprobs, top = choice_arrays(choice, maps, directory)
+            if len(logprobs) == 0:
+                continue
+            row = {field: record.get(field) for field in group_by}
+            row["id"] = record.get("id")
+            row["choice"] = choice.get("index", 0)
+            rows.append(row)
+            values.append(logprobs)
+            tops.append(top)
+    return rows, values, tops
+
+
+def stack_top(tops):
+    """
+    Stack the top logprobs of each answer into one array, padding with
+    NaN to the largest k.
+    """
+    k = max(top.shape[1] for top in tops)
+    stacked = np.full((sum(len(top) for top in tops), k), np.nan, dtype=np.float32)
+    start = 0
+    for top in tops:
+        stacked[start : start + len(top), : top.shape[1]] = top
+        start += len(top)
+    return stacked
+
+
+def token_measures(top):
+    """
+    Return the entropy of the renormalised top logprobs and the margin
+    between the top two of each token, NaN where unknown.
+    """
+    probabilities = np.exp(top.astype(np.float64))
+    probabilities /= np.nansum(probabilities, axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = -np.nansum(probabilities * np.log(probabilities), axis=1)
+    entropy[np.isnan(top).all(axis=1)] = np.nan
+
+    margin = np.full(len(top), np.nan)
+    if top.shape[1] >= 2:
+        # NaNs sort last
+        ranked = -np.sort(-top, axis=1)
+        margin = ranked[:, 0] - ranked[:, 1]
+    return entropy, margin
+
+
+def answer_means(values, starts):
+    """
+    Return the mean of each answer's token values, ignoring NaNs.
+    """
+    known = ~np.isnan(values)
+    totals = np.add.reduceat(np.where(known, values, 0), starts)
+    counts = np.add.reduceat(known.astype(np.int64), starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(counts > 0, totals / counts, np.nan)
+
+
+def process_file(path, group_by, directory=None, span=None):
+    """
+    Return a data frame of the confidence measures of each answer in an
+    answers file, or in a (start, end) byte range of it.
+    """
+    rows, values, tops = read_answers(path, group_by, directory, span)
+    answers = pd.DataFrame(rows, columns=[*group_by, "id", "choice"])
+    if not rows:
+        return answers.assign(tokens=[], **{measure: [] for measure in MEASURES})
+
+    logprobs = np.concatenate(values).astype(np.float64)
+    lengths = np.array([len(v) for v in values])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    entropy, margin = token_measures(stack_top(tops))
+
+    answers["tokens"] = lengths
+    answers["log_likelihood"] = np.add.reduceat(logprobs, starts)
+    answers["perplexity"] = np.exp(-answers["log_likelihood"] / lengths)
+    answers["entropy"] = answer_means(entropy, starts)
+    answers["margin"] = answer_means(margin, starts)
+    return answers
+
+
+def process_files(paths, group_by, directory, jobs):
+    """
+    Return data frames of the confidence measures of the answers in
+    answers files, in order, using jobs processes.
+    """
+    if jobs <= 1:
+        return [process_file(path, group_by, directory) for path in paths]
+
+    # Split each file into byte ranges, so that even one big file is
+    # processed in parallel
+    tasks = [
+        (path, group_by, directory, span)
+        for path in paths
+        for span in byte_ranges(path, jobs)
+    ]
+    with Pool(jobs) as pool:
+        return pool.starmap(process_file, tasks)
+
+
+def json_value(value):
+    """
+    Return a value that json can write, with None for NaN.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def summarise(answers, group_by):
+    """
+    Return the report for each group of answers.
+    """
+    groups = answers.groupby(group_by, dropna=False)
+    report = pd.concat(
+        [
+            groups.size().rename("answers"),
+            groups["tokens"].sum(),
+            groups[list(MEASURES)].mean().add_suffix(".mean"),
+            groups[list(MEASURES)].median().add_suffix(".median"),
+        ],
+        axis=1,
+    ).reset_index()
+
+    outputs = []
+    for row in report.to_dict("records"):
+        output = {field: json_value(row[field]) for field in group_by}
+        output["answers"] = json_value(row["answers"])
+        output["tokens"] = json_value(row["tokens"])
+        for measure in MEASURES:
+            output[measure] = {
+                "mean": json_value(row[f"{measure}.mean"]),
+                "median": json_value(row[f"{measure}.median"]),
+            }
+        outputs.append(output)
+    return outputs
+
+
+def main():
+    """
+    Entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Report confidence measures from logprobs in golem answers."
+    )
+    parser.add_argument("paths", nargs="+", metavar="answers.jsonl")
+    parser.add_argument(
+        "--group-by",
+        type=parse_group_by,
+        default=["model", "temperature", "repeat"],
+        help="Comma separated fields to group by. Default model,temperature,repeat.",
+    )
+    parser.add_argument(
+        "--answers",
+        action="store_true",
+        help="Report each answer rather than each group.",
+    )
+    parser.add_argument(
+        "--logprobs-dir",
+        help="Directory of the logprobs files, if they have moved since the run.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes, each reading part of a file. Default 1.",
+    )
+    args = parser.parse_args()
+
+    results = process_files(args.paths, args.group_by, args.logprobs_dir, args.jobs)
+    if not results:
+        return
+    answers = pd.concat(results, ignore_index=True)
+
+    if args.answers:
+        columns = list(answers.columns)
+        for row in answers.itertuples(index=False):
+            print(json.dumps({c: json_value(v) for c, v in zip(columns, row)}))
+    else:
+        for output in summarise(answers, args.group_by):
+            print(json.dumps(output))
+
+
+if __name__ == "__main__":
+    main()
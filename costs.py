@@ -8,34 +8,45 @@ and calculates experiment costs using pricing data from etc/models.yaml.
 from pathlib import Path
 import json
 import sys
-import yaml
+
+import registry
 
 
 def load_pricing():
     """Load pricing data from etc/models.yaml and build lookup dictionary."""
-    pricing_data = {}
+    return {
+        key: model_entry["pricing"]
+        for key, model_entry in registry.models().items()
+        if model_entry.get("pricing")
+    }
 
-    models_yaml = Path(__file__).parent / "etc" / "models.yaml"
-    try:
-        with open(models_yaml, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f)
-            if data and "models" in data:
-                for model_entry in data["models"]:
-                    pricing = model_entry.get("pricing", {})
-
-                    if pricing:
-                        # Add entries for all keys in "keys" field
-                        for key in model_entry.get("keys", []):
-                            pricing_data[key] = pricing
-    except FileNotFoundError:
-        print(
-            f"Warning: {models_yaml} not found, costs will not be calculated",
-            file=sys.stderr,
-        )
-    except yaml.YAMLError as e:
-        print(f"Warning: Error parsing {models_yaml}: {e}", file=sys.stderr)
-
-    return pricing_data
+
+def usage_tokens(response):
+    """Return (input tokens, output tokens) from a response's usage data."""
+    usage = response.get("usage") or response.get("usageMetadata") or {}
+
+    # OpenAI, Anthropic and Gemini style JSON respectively
+    tokens_in = usage.get(
+        "prompt_tokens", usage.get("input_tokens", usage.get("promptTokenCount", 0))
+    )
+    tokens_out = usage.get(
+        "completion_tokens",
+        usage.get("output_tokens", usage.get("candidatesTokenCount", 0)),
+    )
+    return tokens_in or 0, tokens_out or 0
+
+
+def result_cost(result, pricing_data):
+    """Return the cost of a golem result, or None if its model has no pricing."""
+    pricing = pricing_data.get(result["model"])
+    if pricing is None:
+        return None
+    tokens_in, tokens_out = usage_tokens(result["response"])
+    # Pricing is per million tokens
+    return (
+        tokens_in * pricing.get("input_price", 0.0)
+        + tokens_out * pricing.get("output_price", 0.0)
+    ) / 1_000_000
 
 
 def process_file(filename, pricing_data):
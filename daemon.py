@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+"""
+A long-lived golem server, so that repeated golem commands don't pay
+for Python startup, imports, credential fetches and new TLS
+connections every time.
+
+The daemon listens on a Unix socket. golemc.py sends it a command
+line, as one JSON line {"argv": [...], "cwd": "..."}, and the daemon
+replies with one JSON message per line: {"stdout": ...} for each line
+of output (the same results golem prints), {"stderr": ...} for usage
+and log messages, then {"exit": status}, with "error" if golem
+failed (which has been logged already). Every request shares one
+session, so connections stay warm between requests.
+
+Requests run with the daemon's environment (e.g., API keys), and
+options that configure a whole process (--hedge, --metrics-port,
+--profile and --profile-output) are ignored. The daemon can't read
+input from the client's stdin (-f -).
+
+Usage: daemon.py [--socket PATH]
+"""
+
+import argparse
+import json
+import logging
+import itertools
+import os
+import signal
+import socketserver
+import sys
+import threading
+
+from golem import execute, make_parser, prepare
+from golemc import default_socket
+from util import GolemError, fatal, new_session
+
+CONNECTIONS = 100  # Connections kept per host, shared by every request
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Names of the threads serving requests, whose logs go to their clients
+REQUEST_THREAD = "golem-request"
+
+# Options holding file paths, which are relative to the client's directory
+PATH_OPTIONS = (
+    "messages",
+    "questions",
+    "template",
+    "system_prompt",
+    "db",
+    "queue",
+    "output_dir",
+    "logprobs_file",
+)
+
+# Options that configure the whole process, not a request
+PROCESS_OPTIONS = ("hedge", "metrics_port", "profile", "profile_output")
+
+
+def resolve_paths(args, cwd):
+    """
+    Make relative file path options relative to the client's
+    directory.
+    """
+    for name in PATH_OPTIONS:
+        value = getattr(args, name)
+        if value == "-":
+            fatal(f"The daemon can't read --{name.replace('_', '-')} from stdin")
+        if isinstance(value, str) and not os.path.isabs(value):
+            setattr(args, name, os.path.join(cwd, value))
+
+
+class RequestParser(argparse.ArgumentParser):
+    """
+    An argument parser that keeps its help, usage and error messages
+    for the client, rather than writing them to the daemon's stdout
+    and stderr, which every thread shares. Errors, --help and
+    --version still raise SystemExit.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.messages = []
+
+    def _print_message(self, message, file=None):
+        if message:
+            stream = "stdout" if file is sys.stdout else "stderr"
+            self.messages.append({stream: message.rstrip("\n")})
+
+
+class ClientLogHandler(logging.Handler):
+    """
+    Send the log records of a request's threads, i.e., the thread
+    serving it and the threads it starts, to its client.
+    """
+
+    def __init__(self, thread_name, send):
+        super().__init__()
+        self.thread_name = thread_name
+        self.send = send
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    def emit(self, record):
+        name = record.threadName
+        if name != self.thread_name and not name.startswith(self.thread_name + "_"):
+            return
+        try:
+            self.send({"stderr": self.format(record)})
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.handleError(record)
+
+
+def daemon_record(record):
+    """
+    Return whether a log record is the daemon's own, rather than a
+    request's.
+    """
+    return not record.threadName.startswith(REQUEST_THREAD)
+
+
+class GolemHandler(socketserver.StreamRequestHandler):
+    """
+    Run one golem command line and stream its output back.
+    """
+
+    numbers = itertools.count(1)
+
+    def setup(self):
+        super().setup()
+        # Results and log records are sent from several threads
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        """
+        Send a message to the client.
+        """
+        with self.lock:
+            self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+    def parse(self, argv):
+        """
+        Parse a command line, sending any help or usage messages to the
+        client.
+        """
+        parser = make_parser(RequestParser)
+        try:
+            return parser.parse_args(argv)
+        finally:
+            for message in parser.messages:
+                self.send(message)
+
+    def handle(self):
+        thread = threading.current_thread()
+        thread.name = f"{REQUEST_THREAD}-{next(self.numbers)}"
+        log = ClientLogHandler(thread.name, self.send)
+        logging.getLogger().addHandler(log)
+        try:
+            self.respond()
+        finally:
+            logging.getLogger().removeHandler(log)
+
+    def respond(self):
+        """
+        Run the client's command line.
+        """
+        request = json.loads(self.rfile.readline())
+        status = 0
+        error = None
+        try:
+            args = self.parse(request["argv"])
+            for name in PROCESS_OPTIONS:
+                if getattr(args, name):
+                    logging.warning("Ignoring --%s in the daemon", name.replace("_", "-"))
+            resolve_paths(args, request["cwd"])
+            prepare(args)
+            status = execute(
+                args,
+                lambda result: self.send({"stdout": json.dumps(result)}),
+                self.server.client,
+            )
+        except BrokenPipeError:
+            # The client has gone
+            return
+        except GolemError as e:
+            status, error = 1, str(e)
+        except SystemExit as e:
+            # e.g., argparse errors and --help
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.exception("Request failed")
+            status, error = 1, f"{type(e).__name__}: {e}"
+
+        message = {"exit": status}
+        if error is not None:
+            message["error"] = error
+        try:
+            self.send(message)
+        except BrokenPipeError:
+            pass
+
+
+class GolemServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serve each client on its own thread, sharing a session.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, client):
+        super().__init__(path, GolemHandler)
+        self.client = client
+
+
+def main():
+    """
+    Entry point.
+    """
+    parser = argparse.ArgumentParser(description="Serve golem over a Unix socket.")
+    parser.add_argument(
+        "--socket", default=default_socket(), help="Path of the Unix socket."
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(daemon_record)
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+
+    # Only this user may connect
+    umask = os.umask(0o177)
+    try:
+        server = GolemServer(args.socket, new_session(CONNECTIONS))
+    finally:
+        os.umask(umask)
+
+    # Clean up on kill as well as Ctrl-C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    logging.info("Serving golem on %s", args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.client.close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,45 @@
 #!/usr/bin/env python3
 """
 Apply an f-string style template to every line in a JSONL file.
+
+Values substituted into the template are JSON escaped, so that a
+template of JSON produces valid JSONL. See also golem --questions and
+--template, which render prompts on the fly.
 """
 
 import argparse
 import json
+from multiprocessing import Pool
+import os
+import sys
+
+# The template engine is shared with golem, one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from template import compile_template, render  # pylint: disable=wrong-import-position
 
-# pylint: disable=eval-used
+# pylint: disable=global-statement
+
+CHUNKSIZE = 1000  # Lines sent to a worker process at a time
+
+TEMPLATE = None  # The compiled template, in each worker process
+RAW = False  # Whether to skip JSON escaping, in each worker process
+
+
+def init_worker(template_string, filename, raw):
+    """
+    Compile the template in a worker process.
+    """
+    global TEMPLATE, RAW
+    TEMPLATE = compile_template(template_string, filename)
+    RAW = raw
+
+
+def render_line(text):
+    """
+    Render the template for a line of JSONL, in a worker process.
+    """
+    return render(TEMPLATE, json.loads(text), RAW)
 
 
 def main():
@@ -23,6 +56,18 @@ def main():
         action="store_true",
         help="Remove line endings from the template (useful for JSONL).",
     )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="Substitute values as they are, without JSON escaping.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to render with, for large inputs. Default 1.",
+    )
 
     args = parser.parse_args()
 
@@ -33,21 +78,20 @@ def main():
         if args.remove_line_endings:
             template_string = template_string.replace("\n", "")
 
-    # Process each line in the JSONL file
+    # Process each line in the JSONL file, in order
     with open(args.jsonl_file, "r", encoding="utf-8") as file:
-        for line in file:
-            # Convert JSON line to dictionary
-            data = json.loads(line.strip())
-
-            # Create a safe environment containing the data and datetime module
-            safe_env = {"line": data}
-
-            # Use eval to interpret the string as an f-string dynamically
-            formatted_string = eval(
-                f"f'''{template_string}'''", {"__builtins__": {}}, safe_env
-            )
-
-            print(formatted_string)
+        if args.jobs > 1:
+            with Pool(
+                args.jobs,
+                initializer=init_worker,
+                initargs=(template_string, args.template_file, args.raw),
+            ) as pool:
+                for formatted_string in pool.imap(render_line, file, CHUNKSIZE):
+                    sys.stdout.write(formatted_string + "\n")
+        else:
+            init_worker(template_string, args.template_file, args.raw)
+            for line in file:
+                sys.stdout.write(render_line(line) + "\n")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+"""
+Vectorised scorers for comparing extracted LLM answers with correct
+answers, a whole column at a time.
+"""
+
+import pandas as pd
+
+ANSWER_PATTERN = r"### Answer:\s*(.*)"
+SPURIOUS_CHARS = r"[\*\]\\\[\]\.]"
+
+
+def extract_answers(answers):
+    """
+    Extract the final answer from each LLM output, or NaN if there
+    isn't one.
+    """
+    return answers.str.extract(ANSWER_PATTERN, expand=False)
+
+
+def normalise(values):
+    """
+    Normalise answers for comparison: case insensitive, without
+    spurious characters or surrounding white space. Missing answers
+    become NaN.
+    """
+    # Insert custom clean ups here.
+    return (
+        values.astype("string")
+        .str.upper()
+        .str.replace(SPURIOUS_CHARS, "", regex=True)
+        .str.strip()
+        .astype(object)
+        .where(values.notna())
+    )
+
+
+def to_elements(values):
+    """
+    Split normalised comma separated answers into a long frame of
+    (row, element) pairs, without duplicates.
+    """
+    elements = normalise(values).str.split(r"\s*,\s*", regex=True).explode()
+    elements = elements.dropna()
+    frame = pd.DataFrame({"row": elements.index, "element": elements.to_numpy()})
+    return frame.drop_duplicates()
+
+
+def jaccard(x, y):
+    """
+    Jaccard index (intersection over union) of the sets of comma
+    separated elements in two columns of answers.
+    """
+    x = x.reset_index(drop=True)
+    y = y.reset_index(drop=True)
+    x_elements = to_elements(x)
+    y_elements = to_elements(y)
+
+    x_sizes = x_elements.groupby("row").size().reindex(x.index, fill_value=0)
+    y_sizes = y_elements.groupby("row").size().reindex(x.index, fill_value=0)
+    intersection = (
+        x_elements.merge(y_elements, on=["row", "element"])
+        .groupby("row")
+        .size()
+        .reindex(x.index, fill_value=0)
+    )
+    union = x_sizes + y_sizes - intersection
+    return (intersection / union.where(union > 0)).to_numpy()
+
+
+def exact(x, y):
+    """
+    1.0 where two columns of answers are identical, else 0.0.
+    """
+    return (x.to_numpy() == y.to_numpy()).astype(float)
+
+
+def normalised(x, y):
+    """
+    1.0 where two columns of answers match after normalisation, else
+    0.0.
+    """
+    return exact(normalise(x), normalise(y))
+
+
+SCORERS = {"jaccard": jaccard, "exact": exact, "normalised": normalised}
+
+
+def score(x, y, scorer="jaccard"):
+    """
+    Score a column of extracted answers against a column of correct
+    answers with the named scorer.
+    """
+    return SCORERS[scorer](x, y)
@@ -9,10 +9,13 @@ the resulting table in summary.psv.
 
 import argparse
 import json
-import re
 
 import pandas as pd
 
+from scoring import SCORERS, extract_answers, score
+
+ANSWER_COLUMNS = ["id", "answer", "repeat", "temperature", "top_p"]
+
 
 def load_jsonl(filename):
     """
@@ -35,65 +38,62 @@ def load_questions(filename):
     return df
 
 
+def answer_fields(data):
+    """
+    Return only the fields of an LLM output needed for the summary.
+    """
+    return {
+        "id": data["id"],
+        "answer": data["answer"],
+        "repeat": data["repeat"],
+        "temperature": data["temperature"],
+        "top_p": data["top_p"] if "top_p" in data else None,
+    }
+
+
 def load_answers(filename):
     """
     Load answers as a Pandas data frame.
     """
     data = load_jsonl(filename)
-    ids = [x["id"] for x in data]
-    answers = [x["answer"] for x in data]
-    temperatures = [x["temperature"] for x in data]
-    repeats = [x["repeat"] for x in data]
-    top_ps = [x["top_p"] if "top_p" in x else None for x in data]
-
-    df = pd.DataFrame(
-        {
-            "id": ids,
-            "answer": answers,
-            "repeat": repeats,
-            "temperature": temperatures,
-            "top_p": top_ps,
-        }
-    )
-    return df
+    return pd.DataFrame([answer_fields(x) for x in data], columns=ANSWER_COLUMNS)
 
 
-def extract_answer(text):
+def read_answers(filename, chunksize):
     """
-    Extract the final answer.
+    Generate answers as Pandas data frames of up to chunksize rows,
+    keeping only the fields needed for the summary.
     """
-    pattern = r"### Answer:\s*(.*)"
-    match = re.search(pattern, text)
-    if match:
-        return match.group(1)
-    return None
+    rows = []
+    with open(filename, "r", encoding="utf-8") as file:
+        for line in file:
+            rows.append(answer_fields(json.loads(line)))
+            if len(rows) >= chunksize:
+                yield pd.DataFrame(rows, columns=ANSWER_COLUMNS)
+                rows = []
+    if rows:
+        yield pd.DataFrame(rows, columns=ANSWER_COLUMNS)
 
 
-def str_to_set(s):
+def mark(df, scorer):
     """
-    Convert a string of elements to a set.
+    Extract, clean up and score the answers in a data frame of
+    questions joined to answers.
     """
-    if s is None:
-        return set()
-
-    # Insert custom clean ups here.
-    s = s.upper()  # We want case insensitive
-    s = re.sub(r"[\*\]\\\[\]\.]", "", s)  # spurious chars
-    s = re.split(r"\s*,\s*", s.strip())
-    return set(s)
+    df["cleanAnswer"] = extract_answers(df["answer"])
 
+    # Remove all carriage returns (\n) and pipe symbols (|) from the 'answer' column
+    df["answer"] = (
+        df["answer"]
+        .str.replace("\n", "", regex=False)
+        .str.replace("|", "", regex=False)
+    )
 
-def jaccard_index(x, y):
-    """
-    Compute the Jaccard Index (intersection over union for two sets.
-    """
-    print(f"x {x}, y {y}")
-    i = x.intersection(y)
-    u = x.union(y)
-    return len(i) / len(u)
+    df["score"] = score(df["cleanAnswer"], df["correctAnswer"], scorer)
+    return df
 
 
-def run(question_file, answer_file, summary_file):
+def run(question_file, answer_file, summary_file, scorer="jaccard"):
     """
     Combine question and answer files into a summary with marked answers.
     """
@@ -104,29 +104,46 @@ def run(question_file, answer_file, summary_file):
         questions = questions.rename(columns={"answer": "correctAnswer"})
 
     answers = load_answers(answer_file)
-    df = pd.merge(questions, answers, on="id", how="inner")
+    df = mark(pd.merge(questions, answers, on="id", how="inner"), scorer)
 
-    df["cleanAnswer"] = df["answer"].apply(extract_answer)
+    print(df[["cleanAnswer", "correctAnswer", "score"]])
 
-    # Remove all carriage returns (\n) and pipe symbols (|) from the 'answer' column
-    df["answer"] = (
-        df["answer"]
-        .str.replace("\n", "", regex=False)
-        .str.replace("|", "", regex=False)
-    )
+    # Use PSV because commas are common in LLM output.
+    df.to_csv(summary_file, sep="|", index=False)
 
-    df["x"] = df["cleanAnswer"].apply(str_to_set)
-    df["y"] = df["correctAnswer"].apply(str_to_set)
 
-    df["score"] = df.apply(lambda row: jaccard_index(row["x"], row["y"]), axis=1)
+def run_streaming(question_file, answer_file, summary_file, scorer, chunksize):
+    """
+    Combine question and answer files into a summary with marked
+    answers, a chunk of answers at a time, so that memory use is
+    bounded by the questions and the chunk size rather than the
+    answers. Rows are written in answer order.
+    """
+
+    questions = load_questions(question_file)
 
-    print(df[["cleanAnswer", "x", "y", "score"]])
+    if "answer" in questions.columns:
+        questions = questions.rename(columns={"answer": "correctAnswer"})
 
-    del df["x"]
-    del df["y"]
+    # Questions indexed by id, to join each chunk of answers against
+    index = questions.set_index("id")
+    columns = list(questions.columns) + [
+        column for column in ANSWER_COLUMNS if column != "id"
+    ]
 
+    rows = 0
+    header_written = False
     # Use PSV because commas are common in LLM output.
-    df.to_csv(summary_file, sep="|", index=False)
+    with open(summary_file, "w", encoding="utf-8", newline="") as file:
+        for answers in read_answers(answer_file, chunksize):
+            answers["id"] = answers["id"].astype(str)
+            df = mark(answers.join(index, on="id", how="inner")[columns], scorer)
+            # Even an empty first chunk writes the header
+            df.to_csv(file, sep="|", index=False, header=not header_written)
+            header_written = True
+            rows += len(df)
+
+    print(f"{rows} answers")
 
 
 def main():
@@ -141,8 +158,32 @@ def main():
     )
 
     parser.add_argument("summary_file", help="The path to save the summary PSV file.")
+    parser.add_argument(
+        "--scorer",
+        choices=sorted(SCORERS),
+        default="jaccard",
+        help="How to score answers against correct answers. Default jaccard.",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=None,
+        help=(
+            "Stream the answers this many at a time, writing the summary as it "
+            "goes, for answer files too large to fit in memory."
+        ),
+    )
     args = parser.parse_args()
-    run(args.question_file, args.answer_file, args.summary_file)
+    if args.chunksize:
+        run_streaming(
+            args.question_file,
+            args.answer_file,
+            args.summary_file,
+            args.scorer,
+            args.chunksize,
+        )
+    else:
+        run(args.question_file, args.answer_file, args.summary_file, args.scorer)
 
 
 if __name__ == "__main__":
@@ -4,18 +4,32 @@ Google Gemini support for Golem
 
 # pylint: disable=broad-exception-caught, too-many-arguments, too-many-locals, global-statement
 
-from util import http_request, fatal, lookup_variable
+from registry import DEFAULT_MODELS
+from util import http_request, fatal, GolemError, lookup_variable
+from timing import phase
+
+GEMINI_TIMEOUT = 1200  # Seconds, Gemini can be slow to answer
 
 
 def ask_gemini(
-    provider, model, url, api_key, messages, temperature, seed, top_p, max_tokens
+    provider,
+    model,
+    url,
+    api_key,
+    messages,
+    temperature,
+    seed,
+    top_p,
+    max_tokens,
+    timeout=None,
+    timeout_ceiling=None,
 ):
     """
     Make a request to the Google Gemini API.
     """
 
     if model is None:
-        model = "gemini-2.0-flash"  # Default
+        model = DEFAULT_MODELS["gemini"]  # Default
 
     if api_key is None:
         api_key = lookup_variable("GEMINI_API_KEY")
@@ -66,10 +80,19 @@ def ask_gemini(
     request = None
     response = None
     try:
-        request, response = http_request(url, headers, json_data, timeout=1200)
-        response = response.json()
+        request, response = http_request(
+            url,
+            headers,
+            json_data,
+            timeout=timeout or GEMINI_TIMEOUT,
+            timeout_ceiling=timeout_ceiling,
+        )
+        with phase("decode"):
+            response = response.json()
         answer = response["candidates"][0]["content"]["parts"][0]["text"]
         model = response["modelVersion"]
+    except GolemError:
+        raise
     except Exception as e:
         fatal(f"EXCEPTION: {e} REQUEST: {request} RESPONSE: {response}")
 
@@ -19,12 +19,20 @@ Examples
 
 """
 
-# pylint: disable=too-many-arguments, broad-exception-caught, too-many-locals, too-many-branches, too-many-return-statements, global-statement, too-many-statements
+# pylint: disable=too-many-arguments, broad-exception-caught, too-many-locals, too-many-branches, too-many-return-statements, global-statement, too-many-statements, too-many-nested-blocks, too-many-lines
 
 
 import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextlib
+import cProfile
+import functools
 import json
 import logging
+import os
+import re
+import sys
+import threading
 import time
 
 from util import (
@@ -33,7 +41,19 @@ from util import (
     ensure_json_serializable,
     parse_list,
     add_system_message,
+    estimate_tokens,
     lookup_variable,
+    enable_hedging,
+    adaptive_timeout,
+    record_output_rate,
+    TIMEOUT_FLOOR,
+    TIMEOUT_CEILING,
+    new_session,
+    attempt_seconds,
+    use_session,
+    write_error_log,
+    POOL_SIZE,
+    GolemError,
 )
 
 from ollama import ask_ollama
@@ -42,10 +62,27 @@ from azure import ask_azure
 from azureai import ask_azureai
 from vertex import ask_google
 from anthropic import ask_anthropic
-from gemini import ask_gemini
+from gemini import ask_gemini, GEMINI_TIMEOUT
+from jsonlindex import line_offset
+from logprobs import offloading, side_file
+from template import load_template, render
+from schedule import prefix_order, deduplicate, parse_shard, in_shard
+from planner import plan
+from registry import default_model, rate_limits
+from costs import load_pricing, result_cost, usage_tokens
+import metrics
+import timing
+import workqueue
+import store
+from timing import phase
 
 __version__ = "0.0.1"
 
+STDIN = "-"  # File name for reading from standard input
+
+SPEND_REPORT_INTERVAL = 60  # Seconds between spend reports when using --budget
+BUDGET_EXIT = 3  # Exit status when --budget stops a run
+
 DESCRIPTION = (
     "Golem Copyright (C) 2024 Robert E. Blackwell.\n\n"
     "Use Large Language Model APIs from the command line.\n\n"
@@ -63,6 +100,14 @@ EXAMPLES = (
 )
 
 
+def resolved_model(args):
+    """
+    Return the model that requests with these arguments go to, i.e.,
+    --model or the provider's default, or "" if the provider has none.
+    """
+    return args.model or default_model(args.provider) or ""
+
+
 def ask(
     args,
     messages,
@@ -84,6 +129,16 @@ def ask(
     reasoning_effort = args.reasoning_effort
     response_format = args.response_format
     n = args.n
+    ceiling = args.timeout_ceiling or (
+        GEMINI_TIMEOUT if provider == "gemini" else TIMEOUT_CEILING
+    )
+    timeout = adaptive_timeout(
+        f"{provider}:{resolved_model(args)}",
+        messages,
+        max_tokens,
+        args.timeout_floor,
+        ceiling,
+    )
 
     if provider == "openai":
         return ask_openai(
@@ -100,12 +155,13 @@ def ask(
             top_logprobs,
             reasoning_effort,
             n,
+            timeout,
+            ceiling,
         )
 
     if provider == "deepseek":
         if model is None:
-            # See https://api-docs.deepseek.com/quick_start/pricing
-            model = "deepseek-chat"  # Default
+            model = default_model(provider)
 
         if url is None:
             url = lookup_variable("DEEPSEEK_ENDPOINT")
@@ -128,17 +184,28 @@ def ask(
             top_logprobs,
             reasoning_effort,
             n,
+            timeout,
+            ceiling,
         )
 
     if provider == "gemini":
         return ask_gemini(
-            provider, model, url, key, messages, temperature, seed, top_p, max_tokens
+            provider,
+            model,
+            url,
+            key,
+            messages,
+            temperature,
+            seed,
+            top_p,
+            max_tokens,
+            timeout,
+            ceiling,
         )
 
     if provider == "xai":
         if model is None:
-            # https://docs.x.ai/docs/models?cluster=us-east-1#model-aliases
-            model = "grok-2-1212"  # Default
+            model = default_model(provider)
 
         if url is None:
             url = lookup_variable("XAI_ENDPOINT")
@@ -161,6 +228,8 @@ def ask(
             top_logprobs,
             reasoning_effort,
             n,
+            timeout,
+            ceiling,
         )
 
     if provider == "azure":
@@ -176,6 +245,8 @@ def ask(
             logprobs,
             top_logprobs,
             reasoning_effort,
+            timeout,
+            ceiling,
         )
 
     if provider == "azureai":
@@ -193,11 +264,13 @@ def ask(
             max_tokens,
             logprobs,
             top_logprobs,
+            timeout,
+            ceiling,
         )
 
     if provider == "openrouter":
         if model is None:
-            model = "meta-llama/llama-3.3-8b-instruct:free"
+            model = default_model(provider)
 
         if url is None:
             url = "https://openrouter.ai/api/v1/chat/completions"
@@ -220,11 +293,13 @@ def ask(
             top_logprobs,
             reasoning_effort,
             n,
+            timeout,
+            ceiling,
         )
 
     if provider == "vllm":
         if model is None:
-            model = "facebook/opt-125m"
+            model = default_model(provider)
 
         if url is None:
             url = "http://localhost:8000/v1/completions"
@@ -247,6 +322,8 @@ def ask(
             top_logprobs,
             reasoning_effort,
             n,
+            timeout,
+            ceiling,
         )
 
     if top_logprobs is not None:
@@ -258,13 +335,24 @@ def ask(
     if provider == "anthropic":
         if seed is not None:
             logging.warning("Ignoring seed")
-        return ask_anthropic(model, url, key, messages, temperature, top_p, max_tokens)
+        return ask_anthropic(
+            model, url, key, messages, temperature, top_p, max_tokens, timeout, ceiling
+        )
 
     if provider == "ollama":
         if key is not None:
             logging.warning("Ignoring key")
         return ask_ollama(
-            model, url, messages, temperature, seed, top_p, max_tokens, response_format
+            model,
+            url,
+            messages,
+            temperature,
+            seed,
+            top_p,
+            max_tokens,
+            response_format,
+            timeout,
+            ceiling,
         )
 
     if url is not None:
@@ -274,7 +362,9 @@ def ask(
         logging.warning("Ignoring key")
 
     if provider == "google":
-        return ask_google(model, messages, temperature, seed, top_p, max_tokens)
+        return ask_google(
+            model, messages, temperature, seed, top_p, max_tokens, timeout, ceiling
+        )
 
     fatal(f"Unknown API provider {provider}.")
     return None
@@ -282,7 +372,7 @@ def ask(
 
 def run(identifier, args, repeat, temperature, top_p, messages):
     """
-    Make an LLM request and display results.
+    Make an LLM request and return the result.
     """
 
     # Any of these numeric variables could be a Decimal
@@ -290,12 +380,37 @@ def run(identifier, args, repeat, temperature, top_p, messages):
     top_p = ensure_json_serializable(top_p)
     repeat = ensure_json_serializable(repeat)
 
-    request, response, answer, provider, model = ask(args, messages, temperature, top_p)
+    labels = {"provider": args.provider.lower(), "model": resolved_model(args)}
+    metrics.set_labels(**labels)
+    metrics.inc("golem_requests_sent_total", **labels)
+    metrics.inc("golem_in_flight_requests", **labels)
+    start = time.monotonic()
+    outcome = "failed"
+    try:
+        with phase("ask"):
+            request, response, answer, provider, model = ask(
+                args, messages, temperature, top_p
+            )
+        outcome = "succeeded"
+    finally:
+        metrics.inc("golem_in_flight_requests", -1, **labels)
+        metrics.inc("golem_requests_total", outcome=outcome, **labels)
+
+    metrics.observe("golem_request_duration_seconds", time.monotonic() - start, **labels)
+
+    # Time the attempt that answered, without earlier retries and backoff
+    elapsed = attempt_seconds() or time.monotonic() - start
+    tokens_in, tokens_out = usage_tokens(response)
+    record_output_rate(f"{labels['provider']}:{labels['model']}", tokens_out, elapsed)
+    metrics.inc("golem_prompt_tokens_total", tokens_in, **labels)
+    metrics.inc("golem_completion_tokens_total", tokens_out, **labels)
+
     result = {
         "id": identifier,
         "provider": provider,
         "model": model,
         "timestamp": timestamp(),
+        "elapsed": round(elapsed, 6),
         "request": request,
         "response": response,
         "answer": answer,
@@ -307,15 +422,188 @@ def run(identifier, args, repeat, temperature, top_p, messages):
     if top_p is not None:
         result["top_p"] = top_p
 
-    print(json.dumps(result))
+    return result
+
+
+def print_result(result, flush=False):
+    """
+    Display a result as a line of JSON.
+    """
+    with phase("dump"):
+        print(json.dumps(result), flush=flush)
+
+
+def track_spend(spend, result):
+    """
+    Add the cost of a result to the running total and report it
+    periodically.
+    """
+    cost = result_cost(result, spend["pricing"])
+    if cost is None:
+        if result["model"] not in spend["unpriced"]:
+            logging.warning("No pricing for model %s, spend not tracked", result["model"])
+            spend["unpriced"].add(result["model"])
+    else:
+        spend["cost"] += cost
+        spend["priced"] += 1
+        metrics.set_gauge("golem_spend_dollars", spend["cost"])
+    spend["requests"] += 1
+
+    if time.time() - spend["reported"] >= SPEND_REPORT_INTERVAL:
+        logging.info("Spent $%.4f on %s requests", spend["cost"], spend["requests"])
+        spend["reported"] = time.time()
+
+
+def reserve_spend(spend, item, target):
+    """
+    Return an estimate of the cost of a request, to hold back from the
+    budget while it is in flight: the cost of its prompt and any
+    --max_tokens, or the mean cost of the responses so far if that is
+    more. Unpriced models cost nothing.
+    """
+    target_args = target["args"]
+    pricing = spend["pricing"].get(resolved_model(target_args))
+    if pricing is None:
+        return 0.0
+    # Pricing is per million tokens
+    cost = (
+        estimate_tokens(item["messages"]) * pricing.get("input_price", 0.0)
+        + (target_args.max_tokens or 0) * pricing.get("output_price", 0.0)
+    ) / 1_000_000
+    if spend["priced"]:
+        cost = max(cost, spend["cost"] / spend["priced"])
+    return cost
+
+
+def work_item(identifier, repeat, temperature, top_p, messages):
+    """
+    Make a work item, i.e., one LLM request to be run.
+    """
+    return {
+        "id": identifier,
+        "repeat": repeat,
+        "temperature": temperature,
+        "top_p": top_p,
+        "messages": messages,
+    }
+
+
+def work_items(args):
+    """
+    Generate work items for every combination of repeat, top_p,
+    temperature and prompt.
+    """
+
+    if not args.prompt and STDIN in (args.messages, args.questions):
+        yield from stream_items(args)
+        return
+
+    for repeat in args.repeat:
+
+        logging.debug(
+            "repeat: %s (type: %s)",
+            repeat,
+            type(repeat).__name__,
+        )
+
+        for top_p in args.top_p:
+
+            logging.debug(
+                "top_p: %s (type: %s)",
+                top_p,
+                type(top_p).__name__,
+            )
+
+            for temperature in args.temperature:
+
+                logging.debug(
+                    "temperature: %s (type: %s)",
+                    temperature,
+                    type(temperature).__name__,
+                )
+
+                if args.prompt:
+                    # Immediate mode, useful for testing
+                    messages = [{"role": "user", "content": args.prompt}]
+                    if args.system_prompt:
+                        messages = add_system_message(messages, args.system_prompt)
+                    yield work_item(1, repeat, temperature, top_p, messages)
+                else:
+                    # Batch mode for bulk requests
+                    for data in read_records(args, args.skip):
+                        logging.debug("data: %s", data)
+                        messages = data["messages"]
+                        if args.system_prompt:
+                            messages = add_system_message(messages, args.system_prompt)
+                        yield work_item(data["id"], repeat, temperature, top_p, messages)
+
+                    # Skip is primarily for restarts,
+                    # so only skip on the first iteration
+                    args.skip = 0
+
+
+def stream_items(args):
+    """
+    Generate work items for records read from stdin, which can only be
+    read once, so every combination of repeat, top_p and temperature
+    is generated for each record as it arrives. As for files, --skip
+    skips records in the first combination only.
+    """
 
+    grid = [
+        (repeat, temperature, top_p)
+        for repeat in args.repeat
+        for top_p in args.top_p
+        for temperature in args.temperature
+    ]
+    for n, data in enumerate(read_records(args)):
+        logging.debug("data: %s", data)
+        for point, (repeat, temperature, top_p) in enumerate(grid):
+            if point == 0 and n < args.skip:
+                continue
+            messages = list(data["messages"])
+            if args.system_prompt:
+                messages = add_system_message(messages, args.system_prompt)
+            yield work_item(data["id"], repeat, temperature, top_p, messages)
+
+
+def read_records(args, skip=0):
+    """
+    Generate records, each with an id and messages, from the messages
+    file, or by rendering each question with the template.
+    """
 
-def make_parser():
+    filename = args.questions or args.messages
+    if filename is None:
+        fatal("You must specify a prompt message.")
+    logging.debug("records: %s", filename)
+
+    with contextlib.ExitStack() as stack:
+        if filename == STDIN:
+            file = sys.stdin
+            for _ in range(skip):
+                file.readline()
+        else:
+            file = stack.enter_context(open(filename, "r", encoding="utf-8"))
+            if skip:
+                # Seek straight past skipped lines using the index
+                file.seek(line_offset(filename, skip))
+        logging.debug("Skipped %s", skip)
+        for line in file:
+            with phase("parse"):
+                data = json.loads(line)
+            if args.questions:
+                with phase("render"):
+                    data = json.loads(render(args.template, data))
+            yield data
+
+
+def make_parser(parser_class=argparse.ArgumentParser):
     """
     Construct and configure the golem command line argument parser.
     """
 
-    parser = argparse.ArgumentParser(
+    parser = parser_class(
         prog="golem",
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description=DESCRIPTION,
@@ -371,7 +659,13 @@ def make_parser():
         "--skip",
         type=int,
         default=0,
-        help="Skip n records in the JSONL. Useful for restarting after a crash.",
+        help=(
+            "Skip n records in the JSONL, in the first repeat, top_p and temperature "
+            "only. Useful for restarting after a crash. Uses a byte offset index "
+            "saved alongside the messages file as .idx. With -f -, results are "
+            "written a record at a time rather than a repeat, top_p and temperature "
+            "at a time, so a restart with several of these needs --db."
+        ),
     )
 
     parser.add_argument(
@@ -391,6 +685,113 @@ def make_parser():
         ),
     )
 
+    parser.add_argument(
+        "--shard",
+        type=str,
+        default=None,
+        help=(
+            "Only run shard i of N (e.g. 0/4) of the sweep. Every record, repeat, "
+            "temperature and top_p is deterministically assigned to one shard, so N "
+            "golem processes cover the sweep exactly once. Combine the outputs with "
+            "merge.py."
+        ),
+    )
+
+    parser.add_argument(
+        "--db",
+        type=str,
+        default=None,
+        help=(
+            "Path to a SQLite database to store results in, instead of printing "
+            "them. Work items that already have results in the database are "
+            "skipped, so re-running resumes. Export with store.py."
+        ),
+    )
+
+    parser.add_argument(
+        "--target",
+        action="append",
+        default=None,
+        metavar="PROVIDER:MODEL",
+        help=(
+            "Send every request to this provider and model (e.g. openai:gpt-4o, "
+            "or just ollama for its default model) instead of --provider and "
+            "--model. Repeat to query several targets in one run."
+        ),
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of requests in flight at once, per target. Default 1.",
+    )
+
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        default=None,
+        help=(
+            "Maximum requests per minute, per target. Defaults to the rpm hint "
+            "for the model in etc/models.yaml, if any."
+        ),
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=None,
+        help=(
+            "Append each target's results to its own PROVIDER_MODEL.jsonl file "
+            "in this directory, instead of printing them."
+        ),
+    )
+
+    parser.add_argument(
+        "--queue",
+        type=str,
+        default=None,
+        help=(
+            "Path to a SQLite work queue shared by several golem workers. Work items "
+            "from the prompt or messages file are added to the queue (once), then "
+            "the worker leases and runs items until the queue is drained. Workers "
+            "can join with just --queue."
+        ),
+    )
+
+    parser.add_argument(
+        "--lease",
+        type=float,
+        default=workqueue.LEASE_SECONDS,
+        help=(
+            "Seconds a queue worker has to finish a work item before it is given "
+            f"to another worker. Default {workqueue.LEASE_SECONDS}."
+        ),
+    )
+
+    parser.add_argument(
+        "--order",
+        choices=["file", "prefix"],
+        default="file",
+        help=(
+            "Order in which to send requests. file (the default) follows the "
+            "messages file; prefix groups requests that share a message prefix, "
+            "such as a system prompt or few-shot preamble, to improve prompt "
+            "cache hits on servers like vLLM. prefix reads all records into memory."
+        ),
+    )
+
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help=(
+            "Send identical requests (same messages, repeat, temperature and top_p) "
+            "only once and share the answer between their ids, marking copies with "
+            "shared_from. Only requests with --seed or a temperature of 0 are "
+            "shared. Reads all records into memory."
+        ),
+    )
+
     parser.add_argument(
         "--delay",
         type=float,
@@ -461,6 +862,14 @@ def make_parser():
         help="The number of most likely tokens to return at each token position.",
     )
 
+    parser.add_argument(
+        "--logprobs-file",
+        help=(
+            "Append log probabilities to this binary file (see logprobs.py), "
+            "leaving only a pointer to them in the results."
+        ),
+    )
+
     parser.add_argument(
         "--system-prompt",
         type=str,
@@ -469,7 +878,146 @@ def make_parser():
     )
 
     parser.add_argument(
-        "-f", "--messages", help="Path to a JSONL file containing messages."
+        "--budget",
+        type=float,
+        default=None,
+        help=(
+            "Stop sending requests once the cost of the responses, priced using "
+            "etc/models.yaml, plus the estimated cost of those in flight, would "
+            "exceed this many dollars (e.g. 10.0), and exit with status "
+            f"{BUDGET_EXIT}. Spend is reported every minute."
+        ),
+    )
+
+    parser.add_argument(
+        "--timeout-floor",
+        type=float,
+        default=TIMEOUT_FLOOR,
+        help=(
+            "Minimum seconds to wait for a response. Read timeouts are otherwise "
+            "derived from --max_tokens, the prompt size and observed tokens/s. "
+            f"Default {TIMEOUT_FLOOR}."
+        ),
+    )
+
+    parser.add_argument(
+        "--timeout-ceiling",
+        type=float,
+        default=None,
+        help=(
+            "Maximum seconds to wait for a response, and the timeout used without "
+            f"--max_tokens. Default {TIMEOUT_CEILING} ({GEMINI_TIMEOUT} for gemini)."
+        ),
+    )
+
+    parser.add_argument(
+        "--hedge",
+        type=float,
+        default=None,
+        metavar="PERCENTILE",
+        help=(
+            "Hedge slow requests: once a request has taken longer than this "
+            "percentile of recent request latencies (e.g. 95), send a duplicate "
+            "and use whichever answers first."
+        ),
+    )
+
+    parser.add_argument(
+        "--hedge-budget",
+        type=float,
+        default=5.0,
+        help="Maximum hedged duplicates, as a percentage of requests. Default 5.",
+    )
+
+    parser.add_argument(
+        "--hedge-url",
+        type=str,
+        default=None,
+        help=(
+            "Send hedged duplicates to this alternate, compatible endpoint "
+            "(with the same credentials) rather than --url."
+        ),
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help=(
+            "Serve Prometheus metrics (requests, retries, latency, tokens) on this "
+            "port, e.g. 9100, at /metrics."
+        ),
+    )
+
+    parser.add_argument(
+        "--metrics-host",
+        type=str,
+        default="127.0.0.1",
+        help="Address to serve metrics on. Default 127.0.0.1.",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print a summary of time spent in each phase of handling requests on exit.",
+    )
+
+    parser.add_argument(
+        "--profile-output",
+        type=str,
+        default=None,
+        help="Path to save cProfile statistics for the run (implies --profile).",
+    )
+
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help=(
+            "Estimate the number of requests, prompt tokens, cost and time for the "
+            "run and check prompts against the model context length, without "
+            "sending any requests."
+        ),
+    )
+
+    parser.add_argument(
+        "--plan-latency",
+        type=float,
+        default=None,
+        help=(
+            "Seconds each request takes, e.g., the median from latencies.py, for "
+            "--plan to estimate wall time. Without it, --plan only gives the "
+            "minimum wall time from --delay and rate limits."
+        ),
+    )
+
+    parser.add_argument(
+        "-f",
+        "--messages",
+        help=(
+            "Path to a JSONL file containing messages, or - to stream them from "
+            "standard input."
+        ),
+    )
+
+    parser.add_argument(
+        "--questions",
+        type=str,
+        default=None,
+        help=(
+            "Path to a JSONL file of questions to render into messages with "
+            "--template, as an alternative to --messages."
+        ),
+    )
+
+    parser.add_argument(
+        "--template",
+        type=str,
+        default=None,
+        help=(
+            "Path to an f-string style template, like example/standard/template.jsont, "
+            "that renders each question (available as line) to a JSON object with "
+            "id and messages."
+        ),
     )
 
     parser.add_argument(
@@ -482,24 +1030,280 @@ def make_parser():
     return parser
 
 
-def main():
+def make_targets(args):
     """
-    Entry point.
+    Return the provider and model targets of a run, each with its own
+    copy of the arguments, rate limit and in-flight count.
     """
+    if args.target:
+        pairs = []
+        for text in args.target:
+            # Models may contain colons, e.g., llama3:8b, but providers don't
+            provider, _, model = text.partition(":")
+            pairs.append((provider, model or None))
+    else:
+        pairs = [(args.provider, args.model)]
+
+    targets = []
+    for provider, model in pairs:
+        target_args = argparse.Namespace(**vars(args))
+        target_args.provider = provider
+        target_args.model = model
+        rpm = args.rpm
+        if rpm is None:
+            rpm = rate_limits(model or default_model(provider)).get("rpm")
+        targets.append(
+            {
+                "args": target_args,
+                "name": store.target_name(provider, model),
+                "rpm": rpm,
+                "next": 0.0,
+                "lock": threading.Lock(),
+                "in_flight": 0,
+            }
+        )
+    return targets
 
-    args = make_parser().parse_args()
 
-    if args.verbose:
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+def target_filename(target):
+    """
+    Return the file name for a target's results, with --output-dir.
+    """
+    return re.sub(r"[^\w.-]", "_", target["name"]) + ".jsonl"
+
+
+def has_input(args):
+    """
+    Return whether a prompt, messages or questions were given.
+    """
+    return bool(args.prompt or args.messages or args.questions)
+
+
+def process(args, output=print_result, client=None):
+    """
+    Run all the work items, passing results to output unless they are
+    stored with --db or --output-dir, with an optional session.
+    Return True if --budget stopped the run.
+    """
+
+    queue = workqueue.connect(args.queue) if args.queue else None
+
+    items = []
+    if queue is None or has_input(args):
+        items = work_items(args)
+
+        if args.shard:
+            shard = parse_shard(args.shard)
+            items = (item for item in items if in_shard(item, shard))
+
+        if args.dedup:
+            items = deduplicate(items, args.seed is not None)
+
+        if args.order == "prefix":
+            items = prefix_order(items)
+
+    if queue is not None:
+        # Workers may join without any messages, just to help drain the queue
+        if has_input(args):
+            workqueue.enqueue(queue, items)
+        items = workqueue.leased_items(queue, args.lease)
+
+    files = {}  # target name -> file, with --output-dir
+    with contextlib.ExitStack() as stack:
+        if args.db:
+            db = store.connect(args.db)
+            stack.callback(store.close, db)
+
+            def done(item, target):
+                return store.contains(db, item, target["name"])
+
+            def write(result, target):
+                with phase("dump"):
+                    store.write(db, result, target["name"])
+
+        else:
+            done = None
+            if args.output_dir:
+                os.makedirs(args.output_dir, exist_ok=True)
+
+                def write(result, target):
+                    if target["name"] not in files:
+                        path = os.path.join(args.output_dir, target_filename(target))
+                        files[target["name"]] = stack.enter_context(
+                            open(path, "a", encoding="utf-8")
+                        )
+                    with phase("dump"):
+                        files[target["name"]].write(json.dumps(result) + "\n")
+
+            else:
+
+                def write(result, _target):
+                    output(result)
+
+        if args.logprobs_file:
+            fd, name = stack.enter_context(side_file(args.logprobs_file))
+            write = offloading(write, fd, name)
+
+        return dispatch(args, items, write, queue, done, client)
+
+
+def throttle(target):
+    """
+    Wait until a target's rate limit allows another request.
+    """
+    if not target["rpm"]:
+        return
+    with target["lock"]:
+        now = time.monotonic()
+        start = max(now, target["next"])
+        target["next"] = start + 60 / target["rpm"]
+    if start > now:
+        time.sleep(start - now)
+
+
+def run_item(args, target, item, client):
+    """
+    Run a work item against a target with a session, respecting its
+    rate limit and any --delay.
+    """
+    throttle(target)
+    with use_session(client):
+        result = run(
+            item["id"],
+            target["args"],
+            item["repeat"],
+            item["temperature"],
+            item["top_p"],
+            item["messages"],
         )
-        logging.info(DESCRIPTION)
-    else:
-        logging.basicConfig(
-            level=logging.INFO,
-            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    if args.delay is not None and not args.prompt:
+        logging.debug("Sleeping %s ..", args.delay)
+        time.sleep(args.delay)
+    return result
+
+
+def dispatch(args, items, write, queue=None, done=None, client=None):
+    """
+    Run work items against every target, with up to --concurrency
+    requests in flight per target, writing their results from this
+    thread. done(item, target), if given, says whether a result is
+    already written. client, if given, is a session to share, e.g.,
+    the daemon's, else the run has its own. Return True if --budget
+    stopped the run.
+    """
+
+    targets = make_targets(args)
+    concurrency = args.concurrency
+
+    spend = None
+    if args.budget is not None:
+        spend = {
+            "pricing": load_pricing(),
+            "cost": 0.0,
+            "reserved": 0.0,  # Estimated cost of requests in flight
+            "requests": 0,
+            "priced": 0,  # Requests with a known cost
+            "reported": time.time(),
+            "unpriced": set(),
+        }
+
+    pending = {}  # future -> (item, target, reserved cost)
+    remaining = {}  # id(item) -> targets still to answer it, for the queue
+
+    def finish(item, target, reserved, result):
+        write(result, target)
+        for duplicate in item.get("duplicates", []):
+            write(dict(result, id=duplicate, shared_from=item["id"]), target)
+
+        if queue is not None:
+            remaining[id(item)] -= 1
+            if remaining[id(item)] == 0:
+                del remaining[id(item)]
+                workqueue.complete(queue, item)
+        if spend is not None:
+            spend["reserved"] -= reserved
+            track_spend(spend, result)
+
+    def collect(futures):
+        for future in futures:
+            item, target, reserved = pending.pop(future)
+            target["in_flight"] -= 1
+            finish(item, target, reserved, future.result())
+
+    # A session for this run's connections, shared by its threads
+    owned = client is None
+    if owned:
+        client = new_session(max(concurrency * len(targets), POOL_SIZE))
+
+    # Without concurrency, run requests on this thread, e.g., for --profile
+    executor = None
+    if concurrency > 1 or len(targets) > 1:
+        # Named after this thread, so that their logs can be told apart
+        executor = ThreadPoolExecutor(
+            max_workers=concurrency * len(targets),
+            thread_name_prefix=threading.current_thread().name,
+        )
+
+    stopped = False  # By the budget
+    try:
+        for item in items:
+            todo = [t for t in targets if done is None or not done(item, t)]
+            if queue is not None:
+                remaining[id(item)] = len(todo)
+                if not todo:
+                    del remaining[id(item)]
+                    workqueue.complete(queue, item)
+
+            for target in todo:
+                # Backpressure: wait for a free slot on this target
+                while executor is not None and target["in_flight"] >= concurrency:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+
+                # Send nothing that could take the spend over the budget
+                reserved = 0.0
+                if spend is not None:
+                    reserved = reserve_spend(spend, item, target)
+                    if spend["cost"] + spend["reserved"] + reserved > args.budget:
+                        stopped = True
+                        break
+                    spend["reserved"] += reserved
+
+                if executor is None:
+                    finish(item, target, reserved, run_item(args, target, item, client))
+                    continue
+
+                target["in_flight"] += 1
+                future = executor.submit(run_item, args, target, item, client)
+                pending[future] = (item, target, reserved)
+                collect([future for future in pending if future.done()])
+
+            if stopped:
+                break
+
+        # Write the results of requests already sent
+        while pending:
+            collect(wait(pending, return_when=FIRST_COMPLETED).done)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+        if owned:
+            client.close()
+
+    if stopped:
+        logging.warning(
+            "Budget of $%s reached after %s requests (spent $%.4f), stopping",
+            args.budget,
+            spend["requests"],
+            spend["cost"],
         )
+    return stopped
+
+
+def prepare(args):
+    """
+    Check and convert parsed command line arguments, e.g., parse lists
+    and read the system prompt and template.
+    """
 
     if args.temperature is None:
         args.temperature = [None]
@@ -523,74 +1327,97 @@ def main():
     if args.logprobs == "True":
         args.logprobs = True
 
-    for repeat in args.repeat:
+    if args.questions or args.template:
+        if not (args.questions and args.template):
+            fatal("--questions and --template must be used together.")
+        if args.messages:
+            fatal("Use either --messages or --questions, not both.")
+        args.template = load_template(args.template)
 
-        logging.debug(
-            "repeat: %s (type: %s)",
-            repeat,
-            type(repeat).__name__,
+    if args.concurrency < 1:
+        fatal("--concurrency must be at least 1.")
+
+
+def execute(args, output=print_result, client=None):
+    """
+    Plan or run the work described by prepared arguments, passing each
+    result to output. client, if given, is the session to use. Return
+    the exit status, BUDGET_EXIT if --budget stopped the run.
+    """
+
+    if args.plan:
+        if args.prompt:
+            records = [{"id": 1, "messages": [{"role": "user", "content": args.prompt}]}]
+        else:
+            records = read_records(args)
+        plan(args, records, make_targets(args), output)
+        return 0
+
+    return BUDGET_EXIT if process(args, output, client) else 0
+
+
+def command():
+    """
+    Run the golem command, returning its exit status.
+    """
+
+    args = make_parser().parse_args()
+
+    if args.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        )
+        logging.info(DESCRIPTION)
+    else:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
         )
 
-        for top_p in args.top_p:
+    prepare(args)
 
-            logging.debug(
-                "top_p: %s (type: %s)",
-                top_p,
-                type(top_p).__name__,
-            )
+    if args.hedge is not None:
+        if not 0 < args.hedge < 100:
+            fatal("--hedge must be a percentile between 0 and 100.")
+        enable_hedging(args.hedge, args.hedge_budget, args.hedge_url)
 
-            for temperature in args.temperature:
+    if args.metrics_port is not None and not args.plan:
+        metrics.serve(args.metrics_host, args.metrics_port)
 
-                logging.debug(
-                    "temperature: %s (type: %s)",
-                    temperature,
-                    type(temperature).__name__,
-                )
+    profiler = None
+    if args.profile or args.profile_output:
+        timing.enable()
+        if args.profile_output:
+            profiler = cProfile.Profile()
+            profiler.enable()
 
-                if args.prompt:
-                    # Immediate mode, useful for testing
-                    messages = [{"role": "user", "content": args.prompt}]
-                    if args.system_prompt:
-                        messages = add_system_message(messages, args.system_prompt)
-                    run(1, args, repeat, temperature, top_p, messages)
-                else:
-                    # Batch mode for bulk requests
-                    if args.messages:
-                        logging.debug("messages: %s", args.messages)
-                        with open(args.messages, "r", encoding="utf-8") as file:
-                            nline = 0
-                            for line in file:
-                                data = json.loads(line)
-                                nline += 1
-                                if nline <= args.skip:
-                                    logging.debug("Skipping %s", nline)
-                                    continue
-
-                                logging.debug("data: %s", data)
-                                identifier = data["id"]
-                                messages = data["messages"]
-                                if args.system_prompt:
-                                    messages = add_system_message(
-                                        messages, args.system_prompt
-                                    )
-                                run(
-                                    identifier,
-                                    args,
-                                    repeat,
-                                    temperature,
-                                    top_p,
-                                    messages,
-                                )
-                                if args.delay is not None:
-                                    logging.debug("Sleeping %s ..", args.delay)
-                                    time.sleep(args.delay)
-
-                        # Skip is primarily for restarts,
-                        # so only skip on the first iteration
-                        args.skip = 0
-
-                    else:
-                        fatal("You must specify a prompt message.")
+    # Pass results on as they arrive when golem is part of a pipeline
+    output = print_result
+    if not args.prompt and STDIN in (args.messages, args.questions):
+        output = functools.partial(print_result, flush=True)
+
+    try:
+        return execute(args, output)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile_output)
+        if timing.ENABLED:
+            timing.report()
+
+
+def main():
+    """
+    Entry point. Fatal errors have already been logged, and are
+    recorded in error.log.
+    """
+    try:
+        status = command()
+    except GolemError as e:
+        write_error_log(str(e))
+        sys.exit(1)
+    sys.exit(status)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""
+A thin client for the golem daemon (see daemon.py). It takes the same
+arguments as golem and prints the same output.
+
+Example
+./golemc.py --provider openai --model gpt-4o "Why is the sky blue?"
+"""
+
+import json
+import os
+import socket
+import sys
+
+
+def default_socket():
+    """
+    Return the daemon's socket path, from GOLEM_SOCKET, else in the
+    user's runtime directory.
+    """
+    if os.environ.get("GOLEM_SOCKET"):
+        return os.environ["GOLEM_SOCKET"]
+    directory = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(directory, f"golem-{os.getuid()}.sock")
+
+
+def main():
+    """
+    Entry point.
+    """
+    path = default_socket()
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+    except OSError as e:
+        print(f"Can't connect to the golem daemon on {path}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    with client, client.makefile("rwb") as stream:
+        request = {"argv": sys.argv[1:], "cwd": os.getcwd()}
+        stream.write(json.dumps(request).encode("utf-8") + b"\n")
+        stream.flush()
+
+        for line in stream:
+            message = json.loads(line)
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"] + "\n")
+            elif "stderr" in message:
+                print(message["stderr"], file=sys.stderr)
+            elif "exit" in message:
+                # Any error has been logged to stderr already
+                sys.exit(message["exit"])
+
+    print("The golem daemon closed the connection", file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
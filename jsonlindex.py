@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+"""
+Byte offset indexes for JSONL files, so that golem can skip straight
+to a line, records can be fetched by id without scanning the file,
+and analysis scripts can split a file into byte ranges to process in
+parallel.
+
+An index is kept in a sidecar file next to the JSONL file (FILE.idx,
+and FILE.ids for ids) and is rebuilt whenever the JSONL file's size
+or modification time changes. If it can't be written, e.g., in a
+read-only directory, the file is scanned instead.
+
+Examples
+./jsonlindex.py answers.jsonl               # Build the index
+./jsonlindex.py answers.jsonl --id 17 42    # Print the records with ids 17 and 42
+./jsonlindex.py answers.jsonl --ranges 8    # Split into 8 byte ranges
+"""
+
+from array import array
+import argparse
+import json
+import logging
+import os
+import sys
+
+OFFSET_SIZE = array("q").itemsize
+
+
+def file_signature(path):
+    """
+    Return the size and modification time of a file, used to detect
+    stale indexes.
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def scan_offsets(path):
+    """
+    Return the byte offset of the start of every line in a file,
+    followed by the file size.
+    """
+    offsets = array("q")
+    offset = 0
+    with open(path, "rb") as file:
+        for line in file:
+            offsets.append(offset)
+            offset += len(line)
+    offsets.append(offset)
+    return offsets
+
+
+def write_atomically(path, header, payload):
+    """
+    Write a sidecar file, made up of a JSON header line and a payload,
+    so that readers never see a partial file. Return False if it can't
+    be written, e.g., in a read-only directory.
+    """
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, "wb") as file:
+            file.write(json.dumps(header).encode("utf-8") + b"\n")
+            file.write(payload)
+        os.replace(temporary, path)
+    except OSError as e:
+        logging.warning("Can't write index %s: %s", path, e)
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def read_header(file):
+    """
+    Read the JSON header line of a sidecar file.
+    """
+    line = file.readline()
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def ensure_index(path):
+    """
+    Build the offset index for a JSONL file if it is missing or stale.
+    Return the path of the index and None or, if the index can't be
+    written, None and the offsets themselves.
+    """
+    index_path = f"{path}.idx"
+    signature = file_signature(path)
+    try:
+        with open(index_path, "rb") as file:
+            header = read_header(file)
+        if header is not None and header.get("file") == signature:
+            return index_path, None
+    except FileNotFoundError:
+        pass
+
+    logging.debug("Indexing %s", path)
+    offsets = scan_offsets(path)
+    header = {"file": signature, "lines": len(offsets) - 1}
+    if write_atomically(index_path, header, offsets.tobytes()):
+        return index_path, None
+    # A stale index that can't be replaced must not be read
+    return None, offsets
+
+
+def line_count(path):
+    """
+    Return the number of lines in an indexed JSONL file.
+    """
+    index_path, offsets = ensure_index(path)
+    if offsets is not None:
+        return len(offsets) - 1
+    with open(index_path, "rb") as file:
+        return read_header(file)["lines"]
+
+
+def line_offset(path, n):
+    """
+    Return the byte offset of line n (counting from 0) of a JSONL
+    file, or the file size if there are fewer lines.
+    """
+    index_path, offsets = ensure_index(path)
+    if offsets is not None:
+        return offsets[min(max(n, 0), len(offsets) - 1)]
+    with open(index_path, "rb") as file:
+        header = read_header(file)
+        n = min(max(n, 0), header["lines"])
+        file.seek(n * OFFSET_SIZE, os.SEEK_CUR)
+        offset = array("q")
+        offset.frombytes(file.read(OFFSET_SIZE))
+        return offset[0]
+
+
+def read_offsets(path):
+    """
+    Return all line offsets of a JSONL file, followed by its size.
+    """
+    index_path, offsets = ensure_index(path)
+    if offsets is not None:
+        return offsets
+    with open(index_path, "rb") as file:
+        read_header(file)
+        offsets = array("q")
+        offsets.frombytes(file.read())
+        return offsets
+
+
+def byte_ranges(path, n):
+    """
+    Split a JSONL file into at most n (start, end) byte ranges of
+    roughly equal numbers of lines, each starting on a line boundary.
+    """
+    offsets = read_offsets(path)
+    lines = len(offsets) - 1
+    bounds = sorted({offsets[i * lines // n] for i in range(n)} | {offsets[-1]})
+    return list(zip(bounds, bounds[1:]))
+
+
+def read_range(path, start, end):
+    """
+    Generate the lines of a file between two byte offsets on line
+    boundaries.
+    """
+    with open(path, "rb") as file:
+        file.seek(start)
+        position = start
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+
+def id_index(path):
+    """
+    Return a map of each id (as a string) in a JSONL file to the line
+    numbers of its records, building the FILE.ids sidecar if needed.
+    """
+    ids_path = f"{path}.ids"
+    signature = file_signature(path)
+    try:
+        with open(ids_path, "rb") as file:
+            header = read_header(file)
+            if header is not None and header.get("file") == signature:
+                return json.loads(file.read())
+    except FileNotFoundError:
+        pass
+
+    logging.debug("Indexing ids in %s", path)
+    ids = {}
+    with open(path, "rb") as file:
+        for n, line in enumerate(file):
+            if line.strip():
+                ids.setdefault(str(json.loads(line)["id"]), []).append(n)
+    write_atomically(ids_path, {"file": signature}, json.dumps(ids).encode("utf-8"))
+    return ids
+
+
+def lookup(path, identifier):
+    """
+    Generate the lines of the records with an id, without scanning the
+    file.
+    """
+    lines = id_index(path).get(str(identifier), [])
+    with open(path, "rb") as file:
+        for n in lines:
+            file.seek(line_offset(path, n))
+            yield file.readline()
+
+
+def main():
+    """
+    Entry point.
+    """
+    parser = argparse.ArgumentParser(description="Index a JSONL file by byte offset.")
+    parser.add_argument("jsonl_file", help="Path to the JSONL file.")
+    parser.add_argument("--id", nargs="+", help="Print the records with these ids.")
+    parser.add_argument(
+        "--ranges", type=int, help="Print this many [start, end) byte ranges as JSON."
+    )
+    args = parser.parse_args()
+
+    if args.id:
+        for identifier in args.id:
+            for line in lookup(args.jsonl_file, identifier):
+                sys.stdout.buffer.write(line)
+    elif args.ranges:
+        print(json.dumps(byte_ranges(args.jsonl_file, args.ranges)))
+    else:
+        print(json.dumps({"lines": line_count(args.jsonl_file)}))
+
+
+if __name__ == "__main__":
+    main()
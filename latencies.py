@@ -1,100 +1,266 @@
 #!/usr/bin/env python3
 
-# Read one or more answers.jsonl files, compute inter-record timestamp
-# intervals per model (ignoring non-positive deltas), and output the
-# sample count, median latency (seconds), and quartiles per model as JSONL.
+"""
+Read one or more answers.jsonl files, compute inter-record timestamp
+intervals (ignoring non-positive deltas), and output the sample
+count, median latency (seconds), quartiles and other percentiles per
+group (model by default) as JSONL.
 
+Intervals are summarised in a mergeable log-bucket sketch (as in
+DDSketch), so memory stays constant however many records there are,
+and files can be processed in parallel. Quantiles are accurate to
+within RELATIVE_ACCURACY of the exact value.
+"""
+
+import argparse
 import json
 from json import JSONDecodeError
-import statistics
+import math
+from multiprocessing import Pool
+import os
 import sys
-from collections import defaultdict
 from datetime import datetime
 
+from jsonlindex import read_range
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+GROUP_FIELDS = ("provider", "model", "temperature", "top_p", "repeat")
+
+
+def new_sketch() -> dict:
+    """
+    Return an empty latency sketch.
+    """
+    return {"count": 0, "min": math.inf, "max": -math.inf, "buckets": {}}
+
+
+def sketch_add(sketch: dict, value: float) -> None:
+    """
+    Add a positive value to a sketch.
+    """
+    # Bucket i holds values in (GAMMA ** (i - 1), GAMMA ** i]
+    index = math.ceil(math.log(value) / LOG_GAMMA)
+    sketch["buckets"][index] = sketch["buckets"].get(index, 0) + 1
+    sketch["count"] += 1
+    sketch["min"] = min(sketch["min"], value)
+    sketch["max"] = max(sketch["max"], value)
+
+
+def sketch_merge(sketch: dict, other: dict) -> dict:
+    """
+    Merge another sketch into a sketch, and return it.
+    """
+    for index, count in other["buckets"].items():
+        sketch["buckets"][index] = sketch["buckets"].get(index, 0) + count
+    sketch["count"] += other["count"]
+    sketch["min"] = min(sketch["min"], other["min"])
+    sketch["max"] = max(sketch["max"], other["max"])
+    return sketch
+
+
+def sketch_quantile(sketch: dict, q: float):
+    """
+    Return the q quantile (0 to 1) of a sketch, or None if it is empty.
+    """
+    if sketch["count"] == 0:
+        return None
+    rank = q * (sketch["count"] - 1)
+    seen = 0
+    for index in sorted(sketch["buckets"]):
+        seen += sketch["buckets"][index]
+        if seen > rank:
+            # The value in the bucket with the least relative error
+            value = 2 * GAMMA**index / (GAMMA + 1)
+            return min(max(value, sketch["min"]), sketch["max"])
+    return sketch["max"]
+
 
 def parse_timestamp(ts: str) -> datetime:
+    """
+    Parse an ISO 8601 timestamp, allowing a Z suffix.
+    """
     ts = ts.strip()
     if ts.endswith("Z"):
         ts = ts[:-1] + "+00:00"
     return datetime.fromisoformat(ts)
 
 
-def compute_intervals_for_file(path: str):
-    model_name = None
-    previous_timestamp = None
-    intervals = []
-
-    with open(path, "r", encoding="utf-8") as f:
-        for lineno, line in enumerate(f, start=1):
-            line = line.strip()
-            if not line:
-                continue
-
+def read_records(path: str, span: tuple = None):
+    """
+    Generate the records in a JSONL file, or in a (start, end) byte
+    range of it on line boundaries, skipping invalid lines.
+    """
+    start, end = span or (0, os.path.getsize(path))
+    offset = start
+    for line in read_range(path, start, end):
+        if line.strip():
             try:
-                record = json.loads(line)
+                yield json.loads(line)
             except JSONDecodeError as e:
                 print(
-                    f"warning: {path}:{lineno}: invalid JSON skipped ({e})",
+                    f"warning: {path}: invalid JSON at byte {offset} skipped ({e})",
                     file=sys.stderr,
                 )
-                continue
+        offset += len(line)
+
+
+def group_key(record: dict, group_by: list) -> tuple:
+    """
+    Return the values of the group_by fields of a record.
+    """
+    return tuple(record.get(field) for field in group_by)
+
+
+def compute_intervals_for_file(path: str, group_by: list):
+    """
+    Return a sketch of the intervals between records, per group, in a file.
+    """
+    # The interval before a record is the time its request took (and
+    # any delay), so it counts towards that record's group.
+    previous_timestamp = None
+    sketches = {}
+
+    for record in read_records(path):
+        timestamp_str = record.get("timestamp")
+        if not timestamp_str:
+            continue
+
+        current_timestamp = parse_timestamp(timestamp_str)
+
+        if previous_timestamp is not None:
+            delta_seconds = (current_timestamp - previous_timestamp).total_seconds()
+            if delta_seconds > 0:
+                key = group_key(record, group_by)
+                if key not in sketches:
+                    sketches[key] = new_sketch()
+                sketch_add(sketches[key], delta_seconds)
+
+        previous_timestamp = current_timestamp
+
+    return sketches
+
+
+def merge_sketches(results) -> dict:
+    """
+    Merge the per group sketches of several files.
+    """
+    merged = {}
+    for sketches in results:
+        for key, sketch in sketches.items():
+            if key in merged:
+                sketch_merge(merged[key], sketch)
+            else:
+                merged[key] = sketch
+    return merged
+
+
+def parse_percentiles(text: str) -> list:
+    """
+    Parse comma separated percentiles, for argparse.
+    """
+    percentiles = []
+    for value in text.split(","):
+        if value.strip():
+            percentile = float(value)
+            if not 0 <= percentile <= 100:
+                raise argparse.ArgumentTypeError(f"percentile out of range: {value}")
+            percentiles.append(percentile)
+    return percentiles
+
+
+def parse_group_by(text: str) -> list:
+    """
+    Parse comma separated group fields, for argparse.
+    """
+    fields = [field.strip() for field in text.split(",") if field.strip()]
+    for field in fields:
+        if field not in GROUP_FIELDS:
+            raise argparse.ArgumentTypeError(
+                f"can't group by {field}, choose from {', '.join(GROUP_FIELDS)}"
+            )
+    return fields
 
-            if model_name is None:
-                model_name = record.get("model")
 
-            timestamp_str = record.get("timestamp")
-            if not timestamp_str:
-                continue
+def percentile_name(percentile: float) -> str:
+    """
+    Return the output field name of a percentile, e.g., p99.9.
+    """
+    return f"p{percentile:g}"
 
-            current_timestamp = parse_timestamp(timestamp_str)
 
-            if previous_timestamp is not None:
-                delta_seconds = (current_timestamp - previous_timestamp).total_seconds()
-                if delta_seconds > 0:
-                    intervals.append(delta_seconds)
+def summarise(key: tuple, group_by: list, sketch: dict, percentiles: list) -> dict:
+    """
+    Return the latency report for a group.
+    """
+    output = dict(zip(group_by, key))
+    output["samples"] = sketch["count"]
 
-            previous_timestamp = current_timestamp
+    # quartiles: Q1 (25%), Q2 (median), Q3 (75%)
+    output["median"] = sketch_quantile(sketch, 0.5)
+    output["q1"] = sketch_quantile(sketch, 0.25)
+    output["q3"] = sketch_quantile(sketch, 0.75)
+    output["iqr"] = output["q3"] - output["q1"] if sketch["count"] else None
 
-    return model_name, intervals
+    for percentile in percentiles:
+        output[percentile_name(percentile)] = sketch_quantile(sketch, percentile / 100)
+    return output
 
 
-def main(paths):
-    model_to_intervals = defaultdict(list)
+def report(paths, group_by=("model",), percentiles=(), jobs=1):
+    """
+    Report the latencies in answers files, per group.
+    """
+    group_by = list(group_by)
+    tasks = [(path, group_by) for path in paths]
 
-    for path in paths:
-        model_name, intervals = compute_intervals_for_file(path)
-        if model_name:
-            model_to_intervals[model_name].extend(intervals)
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            sketches = merge_sketches(pool.starmap(compute_intervals_for_file, tasks))
+    else:
+        sketches = merge_sketches(compute_intervals_for_file(*task) for task in tasks)
 
-    for model_name in sorted(model_to_intervals):
-        intervals = model_to_intervals[model_name]
+    for key in sorted(sketches, key=json.dumps):
+        if group_by == ["model"] and key == (None,):
+            # Records without a model can't be attributed
+            continue
+        print(json.dumps(summarise(key, group_by, sketches[key], percentiles)))
 
-        if intervals:
-            median = statistics.median(intervals)
-            # quartiles: Q1 (25%), Q2 (median), Q3 (75%)
-            q1, _, q3 = statistics.quantiles(intervals, n=4)
-            iqr = q3 - q1
-        else:
-            median = None
-            q1 = None
-            q3 = None
-            iqr = None
 
-        output = {
-            "model": model_name,
-            "samples": len(intervals),
-            "median": median,
-            "q1": q1,
-            "q3": q3,
-            "iqr": iqr,
-        }
-        print(json.dumps(output))
+def main():
+    """
+    Entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Summarise inter-record latencies in golem answers."
+    )
+    parser.add_argument("paths", nargs="+", metavar="answers.jsonl")
+    parser.add_argument(
+        "--group-by",
+        type=parse_group_by,
+        default=["model"],
+        help=f"Comma separated fields to group by, from {', '.join(GROUP_FIELDS)}. "
+        "Default model.",
+    )
+    parser.add_argument(
+        "-p",
+        "--percentiles",
+        type=parse_percentiles,
+        default=[90, 99, 99.9],
+        help="Comma separated percentiles to report, e.g., 90,99,99.9 (the default).",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of files to process in parallel. Default 1.",
+    )
+    args = parser.parse_args()
+    report(args.paths, args.group_by, args.percentiles, args.jobs)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print(
-            f"usage: {sys.argv[0]} answers1.jsonl [answers2.jsonl ...]", file=sys.stderr
-        )
-        raise SystemExit(2)
-    main(sys.argv[1:])
+    main()
@@ -0,0 +1,209 @@
+"""
+Compact binary storage for log probabilities.
+
+With --logprobs-file, the logprobs of each choice in a response are
+moved out of the JSONL into a side file, and replaced by a pointer,
+e.g., {"file": "/data/logprobs.bin", "offset": 4096, "tokens": 12,
+"top": 5}. The file is absolute, so results can be read from any
+directory.
+
+Several runs may append to the same side file, as each block is
+written under an exclusive lock on the file.
+
+The side file is a sequence of blocks, one per choice, each starting
+at a multiple of 8 bytes. All numbers are little-endian:
+
+    header         4s magic b"GLP1", uint32 tokens (n), top (k), blob bytes
+    logprobs       float32[n]
+    top_logprobs   float32[n * k], NaN where a token has fewer than k
+    offsets        uint32[n * (k + 1) + 1], into blob, of string i, which
+                   is token i for i < n, else top token (i - n) // k,
+                   (i - n) % k
+    blob           utf-8 token strings
+    padding        to a multiple of 8 bytes
+
+so the arrays can be read in place from a memory map, e.g., with
+numpy.frombuffer. The bytes of each token are not kept.
+"""
+
+from array import array
+import contextlib
+import fcntl
+import math
+import os
+import struct
+import sys
+
+MAGIC = b"GLP1"
+HEADER = struct.Struct("<4sIII")
+ALIGNMENT = 8
+
+
+def little_endian(values):
+    """
+    Return an array in little-endian byte order.
+    """
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def encode(content):
+    """
+    Encode OpenAI style logprobs content, a list of tokens each with a
+    token, logprob and top_logprobs, as a block.
+    """
+    n = len(content)
+    k = max((len(token.get("top_logprobs") or []) for token in content), default=0)
+
+    values = array("f", (token["logprob"] for token in content))
+    top_values = array("f", [math.nan] * (n * k))
+    strings = [token["token"] for token in content] + [""] * (n * k)
+    for i, token in enumerate(content):
+        for j, top in enumerate(token.get("top_logprobs") or []):
+            top_values[i * k + j] = top["logprob"]
+            strings[n + i * k + j] = top["token"]
+
+    blob = bytearray()
+    offsets = array("I", [0])
+    for string in strings:
+        blob += string.encode("utf-8")
+        offsets.append(len(blob))
+
+    block = bytearray(HEADER.pack(MAGIC, n, k, len(blob)))
+    for part in (values, top_values, offsets):
+        block += little_endian(part).tobytes()
+    block += blob
+    block += b"\0" * (-len(block) % ALIGNMENT)
+    return bytes(block)
+
+
+def layout(buffer, offset):
+    """
+    Return the number of tokens, top tokens per token and the offsets
+    of the logprobs, top_logprobs, offsets and blob of a block.
+    """
+    magic, n, k, _ = HEADER.unpack_from(buffer, offset)
+    if magic != MAGIC:
+        raise ValueError(f"No logprobs block at offset {offset}")
+    values = offset + HEADER.size
+    top_values = values + 4 * n
+    offsets = top_values + 4 * n * k
+    blob = offsets + 4 * (n * (k + 1) + 1)
+    return n, k, values, top_values, offsets, blob
+
+
+def read_array(buffer, typecode, start, count):
+    """
+    Read count little-endian numbers from a buffer.
+    """
+    values = array(typecode)
+    values.frombytes(buffer[start : start + 4 * count])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def decode(buffer, offset):
+    """
+    Decode the block at offset back into OpenAI style logprobs content.
+    """
+    n, k, values, top_values, offsets, blob = layout(buffer, offset)
+    logprobs = read_array(buffer, "f", values, n)
+    top_logprobs = read_array(buffer, "f", top_values, n * k)
+    ends = read_array(buffer, "I", offsets, n * (k + 1) + 1)
+    strings = [
+        bytes(buffer[blob + ends[i] : blob + ends[i + 1]]).decode("utf-8")
+        for i in range(n * (k + 1))
+    ]
+
+    content = []
+    for i in range(n):
+        top = [
+            {"token": strings[n + i * k + j], "logprob": top_logprobs[i * k + j]}
+            for j in range(k)
+            if not math.isnan(top_logprobs[i * k + j])
+        ]
+        content.append({"token": strings[i], "logprob": logprobs[i], "top_logprobs": top})
+    return content
+
+
+def append(fd, block):
+    """
+    Append a block to the side file open as fd and return its offset.
+    The file is locked meanwhile, so that no other writer, in this or
+    another process, can move its end between finding the offset and
+    writing the block.
+    """
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        offset = os.lseek(fd, 0, os.SEEK_END)
+        view = memoryview(block)
+        while view:
+            view = view[os.write(fd, view) :]
+        return offset
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def offload(result, fd, name):
+    """
+    Append the logprobs of each choice in a result to the side file
+    open as fd, and called name, replacing them with pointers.
+    """
+    for choice in (result.get("response") or {}).get("choices") or []:
+        content = (choice.get("logprobs") or {}).get("content")
+        if content is None:
+            continue
+        block = encode(content)
+        choice["logprobs"] = {
+            "file": name,
+            "offset": append(fd, block),
+            "tokens": len(content),
+            "top": HEADER.unpack_from(block)[2],
+        }
+    return result
+
+
+@contextlib.contextmanager
+def side_file(path):
+    """
+    Open a side file for appending, yielding its descriptor and its
+    absolute path for pointers.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        yield fd, os.path.abspath(path)
+    finally:
+        os.close(fd)
+
+
+def offloading(write, fd, name):
+    """
+    Wrap a write function so that it offloads logprobs first. Blocks
+    are written straight to the file, so no written pointer is left
+    dangling.
+    """
+
+    def write_offloaded(result, target):
+        write(offload(result, fd, name), target)
+
+    return write_offloaded
+
+
+def load(pointer, directory=None):
+    """
+    Return the logprobs content that a pointer refers to. directory,
+    if given, replaces the directory of the side file, e.g., when the
+    results have been moved.
+    """
+    path = pointer["file"]
+    if directory is not None:
+        path = os.path.join(directory, os.path.basename(path))
+    with open(path, "rb") as file:
+        file.seek(pointer["offset"])
+        header = file.read(HEADER.size)
+        _, n, k, size = HEADER.unpack(header)
+        body = file.read(4 * (n + n * k + n * (k + 1) + 1) + size)
+    return decode(header + body, 0)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Merge the answers files from a sharded golem run (see golem --shard)
+into one, in the order that an unsharded run would have written them,
+and check that every work item in the sweep has been answered.
+
+Example
+./merge.py --repeat "0,1,2" -t "0.0,0.5" -f prompts.jsonl shard-*.jsonl > answers.jsonl
+"""
+
+# pylint: disable=too-many-locals
+
+import argparse
+import json
+import sys
+
+from schedule import work_key
+from util import parse_list
+
+MAX_REPORTED_KEYS = 10  # Number of missing work items to list
+
+
+def index_answers(filenames):
+    """
+    Map the work key of every answer to its (file number, offset,
+    length), and return the map along with the number of duplicates.
+    """
+    index = {}
+    duplicates = 0
+    for number, filename in enumerate(filenames):
+        with open(filename, "rb") as file:
+            offset = 0
+            for line in file:
+                if line.strip():
+                    data = json.loads(line)
+                    key = work_key(
+                        data["id"],
+                        data.get("repeat"),
+                        data.get("temperature"),
+                        data.get("top_p"),
+                    )
+                    if key in index:
+                        duplicates += 1
+                    else:
+                        index[key] = (number, offset, len(line))
+                offset += len(line)
+    return index, duplicates
+
+
+def expected_keys(args):
+    """
+    Generate the work keys of the sweep, in golem's order.
+    """
+    with open(args.messages, "r", encoding="utf-8") as file:
+        identifiers = [json.loads(line)["id"] for line in file if line.strip()]
+
+    for repeat in args.repeat:
+        for top_p in args.top_p:
+            for temperature in args.temperature:
+                for identifier in identifiers:
+                    yield work_key(identifier, repeat, temperature, top_p)
+
+
+def merge(args):
+    """
+    Write the merged answers to stdout and report on completeness.
+    Returns True if all work items were answered.
+    """
+    index, duplicates = index_answers(args.answers)
+    files = [open(filename, "rb") for filename in args.answers]  # pylint: disable=consider-using-with
+
+    missing = []
+    written = set()
+    try:
+        for key in expected_keys(args):
+            if key in written:
+                continue  # Duplicate ids in the messages file
+            location = index.get(key)
+            if location is None:
+                missing.append(key)
+                continue
+            number, offset, length = location
+            files[number].seek(offset)
+            line = files[number].read(length)
+            sys.stdout.buffer.write(line if line.endswith(b"\n") else line + b"\n")
+            written.add(key)
+    finally:
+        for file in files:
+            file.close()
+
+    unexpected = len(index) - len(written)
+
+    summary = {
+        "expected": len(written) + len(missing),
+        "written": len(written),
+        "missing": len(missing),
+        "duplicates": duplicates,
+        "unexpected": unexpected,
+    }
+    print(json.dumps(summary), file=sys.stderr)
+    for key in missing[:MAX_REPORTED_KEYS]:
+        print(f"missing: {key}", file=sys.stderr)
+
+    return not missing
+
+
+def main():
+    """
+    Entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Merge and verify the answers files of a sharded golem run."
+    )
+    parser.add_argument(
+        "--repeat", type=str, default=None, help="The --repeat given to golem."
+    )
+    parser.add_argument(
+        "-t", "--temperature", type=str, default=None, help="The --temperature given to golem."
+    )
+    parser.add_argument("--top_p", type=str, default=None, help="The --top_p given to golem.")
+    parser.add_argument(
+        "-f", "--messages", required=True, help="The messages JSONL file given to golem."
+    )
+    parser.add_argument("answers", nargs="+", help="Answers JSONL files, one per shard.")
+    args = parser.parse_args()
+
+    args.repeat = [0] if args.repeat is None else parse_list(args.repeat)
+    args.temperature = [None] if args.temperature is None else parse_list(args.temperature)
+    args.top_p = [None] if args.top_p is None else parse_list(args.top_p)
+
+    if not merge(args):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Prometheus style metrics for golem.
+
+Golem keeps counters, gauges and histograms in memory, and
+optionally serves them in the Prometheus text format so that long
+runs can be watched from a dashboard.
+"""
+
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+METRICS = {
+    "golem_requests_sent_total": ("counter", "LLM requests sent."),
+    "golem_requests_total": ("counter", "LLM requests completed, by outcome."),
+    "golem_http_responses_total": ("counter", "HTTP responses, by status class."),
+    "golem_retries_total": ("counter", "HTTP retries."),
+    "golem_backoff_seconds_total": ("counter", "Seconds spent backing off before retries."),
+    "golem_in_flight_requests": ("gauge", "LLM requests in progress."),
+    "golem_request_duration_seconds": ("histogram", "LLM request latency, including retries."),
+    "golem_prompt_tokens_total": ("counter", "Prompt tokens reported by the API."),
+    "golem_completion_tokens_total": ("counter", "Completion tokens reported by the API."),
+    "golem_spend_dollars": ("gauge", "Cost of the run so far, when using --budget."),
+    "golem_hedged_requests_total": ("counter", "Duplicate requests sent with --hedge."),
+    "golem_hedge_wins_total": ("counter", "Hedged requests that beat the original."),
+}
+
+_lock = threading.Lock()
+_values = {}  # (name, labels) -> value, or bucket counts plus sum for histograms
+_context = threading.local()  # Labels for the request in progress on this thread
+
+
+def set_labels(**label_values):
+    """
+    Set the labels, e.g., provider and model, used for metrics
+    recorded by the current thread.
+    """
+    _context.labels = label_values
+
+
+def labels():
+    """
+    Return the labels for the current thread.
+    """
+    return getattr(_context, "labels", {})
+
+
+def _key(name, label_values):
+    if name not in METRICS:
+        raise KeyError(f"Unknown metric {name}")
+    return name, tuple(sorted(label_values.items()))
+
+
+def inc(name, amount=1, **label_values):
+    """
+    Increment a counter or gauge.
+    """
+    key = _key(name, label_values)
+    with _lock:
+        _values[key] = _values.get(key, 0) + amount
+
+
+def set_gauge(name, value, **label_values):
+    """
+    Set the value of a gauge.
+    """
+    key = _key(name, label_values)
+    with _lock:
+        _values[key] = value
+
+
+def observe(name, value, **label_values):
+    """
+    Record an observation in a histogram.
+    """
+    key = _key(name, label_values)
+    with _lock:
+        # One count per bucket, then +Inf, then the sum
+        counts = _values.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 2))
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                counts[i] += 1
+        counts[-2] += 1
+        counts[-1] += value
+
+
+def _format_labels(label_items, extra=()):
+    items = list(label_items) + list(extra)
+    if not items:
+        return ""
+    escaped = [
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in items
+    ]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def render():
+    """
+    Return all metrics in the Prometheus text exposition format.
+    """
+    with _lock:
+        values = sorted(
+            (k, list(v) if isinstance(v, list) else v) for k, v in _values.items()
+        )
+
+    lines = []
+    for name, (kind, text) in METRICS.items():
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (metric, label_items), value in values:
+            if metric != name:
+                continue
+            if kind == "histogram":
+                # Bucket counts are already cumulative
+                for bound, count in zip(LATENCY_BUCKETS, value):
+                    le = _format_labels(label_items, [("le", bound)])
+                    lines.append(f"{name}_bucket{le} {count}")
+                le = _format_labels(label_items, [("le", "+Inf")])
+                lines.append(f"{name}_bucket{le} {value[-2]}")
+                lines.append(f"{name}_sum{_format_labels(label_items)} {value[-1]}")
+                lines.append(f"{name}_count{_format_labels(label_items)} {value[-2]}")
+            else:
+                lines.append(f"{name}{_format_labels(label_items)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serve the metrics over HTTP.
+    """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Respond with the current metrics.
+        """
+        body = render().encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.debug(format, *args)
+
+
+def serve(host, port):
+    """
+    Serve metrics from a background thread.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
@@ -2,24 +2,35 @@
 Ollama support
 """
 
-# pylint: disable=too-many-arguments, broad-exception-caught
+# pylint: disable=too-many-arguments, too-many-locals, broad-exception-caught
 
 import json
-from util import fatal, http_request
+from registry import DEFAULT_MODELS
+from util import fatal, GolemError, http_request
+from timing import phase
 
 # Ollama support requires a running Ollama server on port 11434, See
 # https://github.com/ollama/ollama/blob/main/README.md
 
 
 def ask_ollama(
-    model, url, messages, temperature, seed, top_p, max_tokens, response_format
+    model,
+    url,
+    messages,
+    temperature,
+    seed,
+    top_p,
+    max_tokens,
+    response_format,
+    timeout=None,
+    timeout_ceiling=None,
 ):
     """
     Make a request to a locally running Ollama server.
     """
 
     if model is None:
-        model = "llama3"  # Default
+        model = DEFAULT_MODELS["ollama"]  # Default
 
     if url is None:
         url = "http://localhost:11434/api/chat"
@@ -50,11 +61,20 @@ def ask_ollama(
     request = None
     response = None
     try:
-        request, response = http_request(url, {}, json_data)
-        response = response.json()
+        request, response = http_request(
+            url,
+            {},
+            json_data,
+            timeout=timeout,
+            timeout_ceiling=timeout_ceiling,
+        )
+        with phase("decode"):
+            response = response.json()
         answer = response["message"]["content"]
         provider = "ollama"
         model = response["model"]
+    except GolemError:
+        raise
     except Exception as e:
         fatal(f"EXCEPTION: {e} REQUEST: {request} RESPONSE: {response}")
 
@@ -2,9 +2,11 @@
 OpenAI support for golem.
 """
 
-from util import lookup_variable, http_request, fatal
+from registry import DEFAULT_MODELS
+from util import lookup_variable, http_request, fatal, GolemError
+from timing import phase
 
-# pylint: disable=broad-exception-caught, too-many-arguments, too-many-locals
+# pylint: disable=broad-exception-caught, too-many-arguments, too-many-locals, too-many-branches
 
 
 def ask_openai(
@@ -21,6 +23,8 @@ def ask_openai(
     top_logprobs,
     reasoning_effort,
     n,
+    timeout=None,
+    timeout_ceiling=None,
 ):
     """
     Make a request to the OpenAI API.
@@ -29,7 +33,7 @@ def ask_openai(
     # See https://platform.openai.com/docs/api-reference/chat/create
 
     if model is None:
-        model = "gpt-4o"  # Default
+        model = DEFAULT_MODELS["openai"]  # Default
 
     if url is None:
         url = "https://api.openai.com/v1/chat/completions"
@@ -71,10 +75,19 @@ def ask_openai(
     request = None
     response = None
     try:
-        request, response = http_request(url, headers, json_data)
-        response = response.json()
+        request, response = http_request(
+            url,
+            headers,
+            json_data,
+            timeout=timeout,
+            timeout_ceiling=timeout_ceiling,
+        )
+        with phase("decode"):
+            response = response.json()
         answer = response["choices"][0]["message"]["content"]
         model = response["model"]
+    except GolemError:
+        raise
     except Exception as e:
         fatal(f"EXCEPTION: {e} REQUEST: {request} RESPONSE: {response}")
 
@@ -0,0 +1,153 @@
+"""
+Pre-flight planning for golem runs.
+"""
+
+# pylint: disable=too-many-locals
+
+import json
+import logging
+
+import registry
+from schedule import in_shard, is_deterministic, parse_shard, request_key
+from util import add_system_message, estimate_tokens
+
+MAX_REPORTED_IDS = 5  # Number of over-long prompt ids to log
+
+
+def count_requests(args, records, entries):
+    """
+    Return the number of records, requests and prompt tokens for a
+    run, after --skip, --shard and --dedup, noting the ids of records
+    that may exceed each model entry's context.
+    """
+
+    max_tokens = args.max_tokens or 0
+    shard = parse_shard(args.shard) if args.shard else None
+    seeded = args.seed is not None
+
+    # Grid points in work item order, with temperature varying fastest
+    points = [
+        {"repeat": repeat, "temperature": temperature, "top_p": top_p}
+        for repeat in args.repeat
+        for top_p in args.top_p
+        for temperature in args.temperature
+    ]
+
+    requests = 0
+    prompt_tokens = 0
+    seen = set()  # Request keys, with --dedup
+    nrecords = 0
+
+    for nline, data in enumerate(records, start=1):
+        nrecords = nline
+        messages = data["messages"]
+        if args.system_prompt:
+            messages = add_system_message(messages, args.system_prompt)
+        tokens = estimate_tokens(messages)
+
+        for _, entry, over_context in entries:
+            context = entry.get("context")
+            if context is not None and tokens + max_tokens > context:
+                over_context.append(data["id"])
+
+        for n, point in enumerate(points):
+            # Skip only applies to the first pass over the records
+            if n == 0 and nline <= args.skip:
+                continue
+            item = dict(point, id=data["id"], messages=messages)
+            if shard is not None and not in_shard(item, shard):
+                continue
+            if args.dedup and is_deterministic(item, seeded):
+                key = request_key(item)
+                if key in seen:
+                    continue
+                seen.add(key)
+            requests += 1
+            prompt_tokens += tokens
+
+    return nrecords, requests, prompt_tokens
+
+
+def print_json(result):
+    """
+    Print a result as a line of JSON.
+    """
+    print(json.dumps(result))
+
+
+def plan(args, records, targets, output=print_json):
+    """
+    Estimate the requests, tokens, cost and time that a run over the
+    input records would take for each target, without sending any
+    requests, passing an estimate per target to output.
+    """
+
+    grid = len(args.repeat) * len(args.top_p) * len(args.temperature)
+    max_tokens = args.max_tokens or 0
+
+    entries = []
+    for target in targets:
+        target_args = target["args"]
+        model = target_args.model or registry.default_model(target_args.provider)
+        entry = registry.lookup(model)
+        if entry is None:
+            logging.warning("Model %s not found in models.yaml", model)
+            entry = {}
+        entries.append((model, entry, []))
+
+    nrecords, requests, prompt_tokens = count_requests(args, records, entries)
+    completion_tokens = requests * max_tokens if max_tokens else None
+
+    for target, (model, entry, over_context) in zip(targets, entries):
+        context = entry.get("context")
+        if over_context:
+            logging.warning(
+                "%s prompts may exceed the %s token context of %s, e.g., ids %s",
+                len(over_context),
+                context,
+                model,
+                over_context[:MAX_REPORTED_IDS],
+            )
+
+        pricing = entry.get("pricing", {})
+        input_cost = None
+        output_cost = None
+        if pricing:
+            # Pricing is per million tokens
+            input_cost = prompt_tokens * pricing.get("input_price", 0.0) / 1_000_000
+            if completion_tokens is not None:
+                output_cost = (
+                    completion_tokens * pricing.get("output_price", 0.0) / 1_000_000
+                )
+
+        # Requests run --concurrency at a time, each taking any
+        # --plan-latency and followed by any --delay, and no faster than
+        # the rate limit. Without --plan-latency, only the throttling
+        # is known, which gives a lower bound.
+        min_wall_time = requests * (args.delay or 0.0) / args.concurrency
+        if target["rpm"]:
+            min_wall_time = max(min_wall_time, requests * 60 / target["rpm"])
+        wall_time = None
+        if args.plan_latency is not None:
+            wall_time = max(
+                min_wall_time,
+                requests * (args.plan_latency + (args.delay or 0.0)) / args.concurrency,
+            )
+
+        result = {
+            "provider": target["args"].provider.lower(),
+            "model": model,
+            "records": nrecords,
+            "grid": grid,
+            "requests": requests,
+            "prompt_tokens": prompt_tokens,
+            "max_completion_tokens": completion_tokens,
+            "context": context,
+            "over_context": len(over_context),
+            "input_cost": input_cost,
+            "max_output_cost": output_cost,
+            "min_wall_time": min_wall_time,
+            "wall_time": wall_time,
+        }
+
+        output(result)
@@ -0,0 +1,204 @@
+"""
+A registry of models, compiled from etc/models.yaml.
+
+The YAML is parsed once and the compiled registry (entries, plus a
+map of every alias in their keys to an entry) is cached as JSON in
+~/.cache/golem, so later runs and tools skip YAML parsing until
+models.yaml changes.
+
+Besides pricing and context length, an entry may give rate limit
+hints, e.g., rpm (requests per minute) and tpm (tokens per minute).
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import yaml
+
+MODELS_YAML = Path(__file__).parent / "etc" / "models.yaml"
+
+RATE_LIMIT_FIELDS = ("rpm", "tpm")
+
+# Models used when no --model is given
+DEFAULT_MODELS = {
+    "openai": "gpt-4o",
+    "deepseek": "deepseek-chat",  # https://api-docs.deepseek.com/quick_start/pricing
+    "gemini": "gemini-2.0-flash",
+    "xai": "grok-2-1212",  # https://docs.x.ai/docs/models?cluster=us-east-1#model-aliases
+    "azure": "gpt-4o-2024-05-13",
+    "openrouter": "meta-llama/llama-3.3-8b-instruct:free",
+    "vllm": "facebook/opt-125m",
+    "anthropic": "claude-3-5-sonnet-20240620",
+    "ollama": "llama3",
+    "google": "gemini-1.5-flash-001",
+}
+
+_REGISTRY = {}  # The compiled registry, once loaded in this process
+
+
+def default_model(provider):
+    """
+    Return the default model for a provider, or None.
+    """
+    return DEFAULT_MODELS.get(provider.lower())
+
+
+def cache_path(models_yaml):
+    """
+    Return the path of the compiled registry cache for a models.yaml.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    digest = hashlib.sha1(str(Path(models_yaml).resolve()).encode("utf-8")).hexdigest()
+    return Path(cache_home) / "golem" / f"models-{digest[:12]}.json"
+
+
+def context_length(entry):
+    """
+    Return the context length of a model entry in tokens, or None.
+    """
+    tokens = entry.get("context")
+    if isinstance(tokens, str):
+        # e.g., "1,048,576"
+        try:
+            tokens = int(tokens.replace(",", ""))
+        except ValueError:
+            tokens = None
+    return tokens
+
+
+def compile_models(data):
+    """
+    Compile parsed models.yaml data into entries and a map of each
+    alias to the index of its entry.
+    """
+    entries = []
+    aliases = {}
+    for entry in (data or {}).get("models") or []:
+        # JSON round trip, e.g., for dates
+        entry = json.loads(json.dumps(entry, default=str))
+        entry["context"] = context_length(entry)
+        index = len(entries)
+        entries.append(entry)
+        for key in entry.get("keys", []):
+            aliases[key] = index
+    # The model names are aliases too, unless they are already keys
+    for index, entry in enumerate(entries):
+        if entry.get("model") is not None:
+            aliases.setdefault(entry["model"], index)
+    return {"entries": entries, "aliases": aliases}
+
+
+def signature(path):
+    """
+    Return the size and modification time of a file, used to detect a
+    stale cache.
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_cache(path, source):
+    """
+    Return the compiled registry from a cache file if it matches the
+    source signature, else None.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            cached = json.load(file)
+        if cached.get("source") == source:
+            return cached["registry"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def write_cache(path, source, registry):
+    """
+    Write the compiled registry cache, so that readers never see a
+    partial file. Failures only cost speed.
+    """
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump({"source": source, "registry": registry}, file)
+        os.replace(temporary, path)
+    except OSError as e:
+        logging.debug("Can't write model registry cache %s: %s", path, e)
+
+
+def load(models_yaml=MODELS_YAML):
+    """
+    Return the compiled registry, from memory, the cache or by parsing
+    models.yaml, whichever is the first that is up to date.
+    """
+    try:
+        source = signature(models_yaml)
+    except FileNotFoundError:
+        logging.warning("%s not found, no model pricing or context", models_yaml)
+        return {"entries": [], "aliases": {}}
+
+    if _REGISTRY.get("source") == source:
+        return _REGISTRY["registry"]
+
+    path = cache_path(models_yaml)
+    registry = read_cache(path, source)
+    if registry is None:
+        logging.debug("Compiling %s", models_yaml)
+        try:
+            with open(models_yaml, "r", encoding="utf-8") as file:
+                data = yaml.safe_load(file)
+        except yaml.YAMLError as e:
+            logging.warning("Error parsing %s: %s", models_yaml, e)
+            data = None
+        registry = compile_models(data)
+        write_cache(path, source, registry)
+
+    _REGISTRY["source"] = source
+    _REGISTRY["registry"] = registry
+    return registry
+
+
+def lookup(model):
+    """
+    Return the registry entry for a model name or alias, or None.
+    """
+    registry = load()
+    index = registry["aliases"].get(model)
+    return None if index is None else registry["entries"][index]
+
+
+def models():
+    """
+    Return every alias mapped to its model entry.
+    """
+    registry = load()
+    return {
+        alias: registry["entries"][index] for alias, index in registry["aliases"].items()
+    }
+
+
+def pricing(model):
+    """
+    Return the pricing of a model (per million tokens), or None.
+    """
+    entry = lookup(model)
+    return (entry or {}).get("pricing") or None
+
+
+def context(model):
+    """
+    Return the context length of a model in tokens, or None.
+    """
+    return (lookup(model) or {}).get("context")
+
+
+def rate_limits(model):
+    """
+    Return the rate limit hints for a model, e.g., {"rpm": 500}.
+    """
+    entry = lookup(model) or {}
+    return {name: entry[name] for name in RATE_LIMIT_FIELDS if entry.get(name)}
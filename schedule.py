@@ -0,0 +1,134 @@
+"""
+Work item scheduling for golem.
+"""
+
+import hashlib
+import json
+import logging
+
+from util import fatal
+
+
+def prefix_key(messages):
+    """
+    Return a sort key for a list of messages, such that messages
+    which share a common prefix sort next to each other.
+    """
+    key = []
+    for message in messages:
+        content = message.get("content")
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        key.append((message.get("role", ""), content))
+    return key
+
+
+def prefix_order(items):
+    """
+    Reorder work items so that those sharing a message prefix
+    (e.g., the same system prompt or few-shot preamble) are sent
+    consecutively, improving server side prompt cache hit rates.
+    """
+    # A lexicographic sort visits the items in the same order as a
+    # depth first walk of a trie over the messages, so every shared
+    # prefix forms one contiguous run. The sort is stable, so
+    # identical prompts keep their repeat, top_p and temperature
+    # order. N.B. All work items are held in memory.
+    return sorted(items, key=lambda item: prefix_key(item["messages"]))
+
+
+def request_key(item):
+    """
+    Return a digest of the request that a work item makes,
+    ignoring its id.
+    """
+    # Model, seed and the other sampling parameters are fixed for a
+    # run, so identical messages, repeat, temperature and top_p mean
+    # identical requests. Including the repeat keeps repeats
+    # independent.
+    canonical = json.dumps(
+        [item["repeat"], item["temperature"], item["top_p"], item["messages"]],
+        sort_keys=True,
+        default=float,  # Decimals
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).digest()
+
+
+def is_deterministic(item, seeded):
+    """
+    Return True if a work item's request should always get the same
+    answer, i.e., it has a seed or a temperature of 0.
+    """
+    return seeded or (item["temperature"] is not None and item["temperature"] == 0)
+
+
+def deduplicate(items, seeded=False):
+    """
+    Merge work items that make identical, deterministic requests (see
+    is_deterministic). The first item of each group is kept, with the
+    ids of the others listed under "duplicates" so that its answer can
+    be shared with them. Sampled requests are all sent.
+    """
+    groups = {}
+    total = 0
+    sampled = 0
+    for item in items:
+        total += 1
+        if is_deterministic(item, seeded):
+            key = request_key(item)
+        else:
+            # Independent samples, so never shared
+            sampled += 1
+            key = total
+        if key in groups:
+            groups[key]["duplicates"].append(item["id"])
+        else:
+            groups[key] = dict(item, duplicates=[])
+    if sampled:
+        logging.warning(
+            "Not deduplicating %s sampled requests, set --seed or a temperature of 0",
+            sampled,
+        )
+    logging.info("Deduplicated %s requests to %s", total, len(groups))
+    return list(groups.values())
+
+
+def work_key(identifier, repeat, temperature, top_p):
+    """
+    Return a string that identifies a work item within a sweep, and
+    matches the corresponding fields of its result.
+    """
+    return json.dumps([identifier, repeat, temperature, top_p], default=float)
+
+
+def parse_shard(string):
+    """
+    Parse a shard specification i/N, e.g. 0/4 is the first of four
+    shards.
+    """
+    try:
+        index, count = (int(element) for element in string.split("/"))
+    except ValueError:
+        index, count = -1, 0
+    if not 0 <= index < count:
+        fatal(f"{string} is not a valid shard i/N with 0 <= i < N")
+    return index, count
+
+
+def shard_of(key, count):
+    """
+    Deterministically assign a work key to one of count shards.
+    """
+    # Python's hash() is salted per process, so use a stable digest
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def in_shard(item, shard):
+    """
+    Return True if a work item belongs to the given (index, count)
+    shard.
+    """
+    index, count = shard
+    key = work_key(item["id"], item["repeat"], item["temperature"], item["top_p"])
+    return shard_of(key, count) == index
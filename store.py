@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""
+An indexed SQLite result store for golem, as an alternative to JSONL
+on stdout (see golem --db).
+
+Usage: store.py results.db > answers.jsonl
+Exports the results back to JSONL, as golem would have printed them.
+"""
+
+import json
+import sqlite3
+import sys
+
+from costs import usage_tokens
+from schedule import work_key
+
+BATCH_SIZE = 100  # Results per transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT NOT NULL,
+    target TEXT NOT NULL,
+    id,
+    provider TEXT,
+    model TEXT,
+    repeat,
+    temperature,
+    top_p,
+    timestamp TEXT,
+    elapsed REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    answer TEXT,
+    shared_from,
+    request BLOB,
+    response BLOB
+);
+CREATE INDEX IF NOT EXISTS results_key_target ON results (key, target);
+CREATE INDEX IF NOT EXISTS results_id ON results (id);
+CREATE INDEX IF NOT EXISTS results_model ON results (model, temperature, top_p);
+"""
+
+COLUMNS = (
+    "key",
+    "target",
+    "id",
+    "provider",
+    "model",
+    "repeat",
+    "temperature",
+    "top_p",
+    "timestamp",
+    "elapsed",
+    "prompt_tokens",
+    "completion_tokens",
+    "answer",
+    "shared_from",
+    "request",
+    "response",
+)
+
+
+def connect(path):
+    """
+    Open (creating if necessary) a result store.
+    """
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.executescript(SCHEMA)
+    # Stores made before elapsed was recorded
+    if "elapsed" not in [row[1] for row in conn.execute("PRAGMA table_info(results)")]:
+        conn.execute("ALTER TABLE results ADD COLUMN elapsed REAL")
+    return {"conn": conn, "pending": 0}
+
+
+def target_name(provider, model):
+    """
+    Return the name of the provider and model that were asked for,
+    which may differ from the model that answered.
+    """
+    return f"{provider.lower()}:{model or ''}"
+
+
+def contains(store, item, target):
+    """
+    Return True if the store already has a result for a work item.
+    """
+    key = work_key(item["id"], item["repeat"], item["temperature"], item["top_p"])
+    row = store["conn"].execute(
+        "SELECT 1 FROM results WHERE key = ? AND target = ? LIMIT 1", (key, target)
+    ).fetchone()
+    return row is not None
+
+
+def write(store, result, target):
+    """
+    Add a result to the store. Results are committed in batches.
+    """
+    conn = store["conn"]
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+
+    tokens_in, tokens_out = usage_tokens(result["response"])
+    row = (
+        work_key(
+            result["id"], result.get("repeat"), result.get("temperature"), result.get("top_p")
+        ),
+        target,
+        result["id"],
+        result["provider"],
+        result["model"],
+        result.get("repeat"),
+        result.get("temperature"),
+        result.get("top_p"),
+        result["timestamp"],
+        result.get("elapsed"),
+        tokens_in,
+        tokens_out,
+        result["answer"],
+        result.get("shared_from"),
+        json.dumps(result["request"]).encode("utf-8"),
+        json.dumps(result["response"]).encode("utf-8"),
+    )
+    conn.execute(
+        f"INSERT INTO results ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+        row,
+    )
+
+    store["pending"] += 1
+    if store["pending"] >= BATCH_SIZE:
+        conn.execute("COMMIT")
+        store["pending"] = 0
+
+
+def close(store):
+    """
+    Commit any pending results and close the store.
+    """
+    conn = store["conn"]
+    if conn.in_transaction:
+        conn.execute("COMMIT")
+    conn.close()
+
+
+def export(conn, file=sys.stdout):
+    """
+    Write all results as JSONL, in the order they were stored.
+    """
+    query = (
+        "SELECT id, provider, model, timestamp, elapsed, request, response, answer, "
+        "repeat, temperature, top_p, shared_from FROM results ORDER BY rowid"
+    )
+    for row in conn.execute(query):
+        result = {
+            "id": row[0],
+            "provider": row[1],
+            "model": row[2],
+            "timestamp": row[3],
+        }
+        # Stores made before elapsed was recorded
+        if row[4] is not None:
+            result["elapsed"] = row[4]
+        result["request"] = json.loads(row[5])
+        result["response"] = json.loads(row[6])
+        result["answer"] = row[7]
+        for name, value in zip(("repeat", "temperature", "top_p", "shared_from"), row[8:]):
+            if value is not None:
+                result[name] = value
+        print(json.dumps(result), file=file)
+
+
+def main():
+    """
+    Export a store as JSONL on stdout.
+    """
+    if len(sys.argv) != 2:
+        print("Usage: store.py results.db > answers.jsonl", file=sys.stderr)
+        sys.exit(1)
+    export(connect(sys.argv[1])["conn"])
+
+
+if __name__ == "__main__":
+    main()
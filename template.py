@@ -0,0 +1,84 @@
+"""
+f-string style templates for golem, e.g., to render prompts from
+questions (see example/standard/template.jsont).
+
+Values substituted into a template are JSON escaped, so that a
+template of JSON renders valid JSON.
+"""
+
+# pylint: disable=eval-used
+
+import json
+
+
+class Escaped(dict):
+    """
+    A dictionary whose values are JSON escaped when a template looks
+    them up.
+    """
+
+    def __getitem__(self, key):
+        return escape(super().__getitem__(key))
+
+    def __str__(self):
+        return json.dumps(dict(self))
+
+
+class EscapedList(list):
+    """
+    A list whose elements are JSON escaped when a template indexes it.
+    """
+
+    def __getitem__(self, index):
+        value = super().__getitem__(index)
+        if isinstance(index, slice):
+            return EscapedList(value)
+        return escape(value)
+
+    def __str__(self):
+        return json.dumps(list(self))
+
+
+def escape(value):
+    """
+    JSON escape a value for substitution into a template. Strings are
+    escaped for use between quotes, dictionaries and lists are escaped
+    as they are indexed, and anything else becomes JSON.
+    """
+    if isinstance(value, dict):
+        return Escaped(value)
+    if isinstance(value, list):
+        return EscapedList(value)
+    if isinstance(value, str):
+        return json.dumps(value)[1:-1]
+    return json.dumps(value)
+
+
+def compile_template(template_string, filename="<template>"):
+    """
+    Compile a template string once, so it can be rendered many times.
+    """
+    return compile(f"f'''{template_string}'''", filename, "eval")
+
+
+def load_template(filename, remove_line_endings=True):
+    """
+    Read and compile a template file. Line endings are removed by
+    default so that a template spread over several lines renders one
+    line of JSONL.
+    """
+    with open(filename, "r", encoding="utf-8") as file:
+        template_string = file.read()
+    if remove_line_endings:
+        template_string = template_string.replace("\n", "")
+    return compile_template(template_string, filename)
+
+
+def render(template, data, raw=False):
+    """
+    Render a compiled template for one line of data, available to the
+    template as line.
+    """
+    line = data if raw else Escaped(data)
+    # Evaluate the f-string with only the data in scope
+    return eval(template, {"__builtins__": {}}, {"line": line})
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+"""
+Reads one or more answers.jsonl files and reports throughput per
+provider and model (or other groups) as JSONL: output tokens per
+second, seconds per 1k output tokens and prompt tokens per second,
+each as a median and percentiles, along with overall rates.
+
+Request times come from each record's elapsed field (seconds, from
+request to answer, of the attempt that answered). Older files without it
+fall back to the interval since the previous record's timestamp,
+which also includes any --delay.
+
+Examples
+./throughput.py answers.jsonl
+./throughput.py --group-by provider,model,temperature -p 90,99 *.jsonl
+"""
+
+import argparse
+import json
+from multiprocessing import Pool
+
+from costs import usage_tokens
+from latencies import (
+    new_sketch,
+    parse_group_by,
+    parse_percentiles,
+    parse_timestamp,
+    percentile_name,
+    read_records,
+    group_key,
+    sketch_add,
+    sketch_merge,
+    sketch_quantile,
+)
+
+RATES = (
+    "output_tokens_per_second",
+    "seconds_per_1k_output_tokens",
+    "prompt_tokens_per_second",
+)
+
+
+def new_group():
+    """
+    Return empty totals and rate sketches for a group of records.
+    """
+    group = {
+        "samples": 0,
+        "interval_samples": 0,
+        "seconds": 0.0,
+        "prompt_tokens": 0,
+        "output_tokens": 0,
+    }
+    for rate in RATES:
+        group[rate] = new_sketch()
+    return group
+
+
+def add_sample(group, seconds, tokens_in, tokens_out):
+    """
+    Add one request's time and token usage to a group.
+    """
+    group["samples"] += 1
+    group["seconds"] += seconds
+    group["prompt_tokens"] += tokens_in
+    group["output_tokens"] += tokens_out
+    if tokens_out:
+        sketch_add(group["output_tokens_per_second"], tokens_out / seconds)
+        sketch_add(group["seconds_per_1k_output_tokens"], 1000 * seconds / tokens_out)
+    if tokens_in:
+        sketch_add(group["prompt_tokens_per_second"], tokens_in / seconds)
+
+
+def merge_group(group, other):
+    """
+    Merge the totals and sketches of another group into a group.
+    """
+    for name, value in other.items():
+        if name in RATES:
+            sketch_merge(group[name], value)
+        else:
+            group[name] += value
+    return group
+
+
+def process_file(path, group_by):
+    """
+    Return the groups of throughput samples in an answers file.
+    """
+    groups = {}
+    previous_timestamp = None
+
+    for record in read_records(path):
+        timestamp_str = record.get("timestamp")
+        current_timestamp = parse_timestamp(timestamp_str) if timestamp_str else None
+
+        seconds = record.get("elapsed")
+        interval = seconds is None
+        if interval and current_timestamp and previous_timestamp:
+            seconds = (current_timestamp - previous_timestamp).total_seconds()
+        previous_timestamp = current_timestamp or previous_timestamp
+
+        # Deduplicated copies share another record's request
+        if record.get("shared_from") is not None or not seconds or seconds <= 0:
+            continue
+
+        key = group_key(record, group_by)
+        if key not in groups:
+            groups[key] = new_group()
+        tokens_in, tokens_out = usage_tokens(record.get("response") or {})
+        add_sample(groups[key], seconds, tokens_in, tokens_out)
+        groups[key]["interval_samples"] += interval
+
+    return groups
+
+
+def summarise(key, group_by, group, percentiles):
+    """
+    Return the throughput report for a group.
+    """
+    output = dict(zip(group_by, key))
+    for name in ("samples", "interval_samples", "prompt_tokens", "output_tokens"):
+        output[name] = group[name]
+
+    seconds = group["seconds"]
+    output["overall_output_tokens_per_second"] = (
+        group["output_tokens"] / seconds if seconds else None
+    )
+    output["overall_prompt_tokens_per_second"] = (
+        group["prompt_tokens"] / seconds if seconds else None
+    )
+
+    for rate in RATES:
+        sketch = group[rate]
+        output[rate] = {"median": sketch_quantile(sketch, 0.5)}
+        for percentile in percentiles:
+            output[rate][percentile_name(percentile)] = sketch_quantile(
+                sketch, percentile / 100
+            )
+    return output
+
+
+def main():
+    """
+    Entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Report token throughput per provider and model in golem answers."
+    )
+    parser.add_argument("paths", nargs="+", metavar="answers.jsonl")
+    parser.add_argument(
+        "--group-by",
+        type=parse_group_by,
+        default=["provider", "model"],
+        help="Comma separated fields to group by. Default provider,model.",
+    )
+    parser.add_argument(
+        "-p",
+        "--percentiles",
+        type=parse_percentiles,
+        default=[10, 90, 99],
+        help="Comma separated percentiles to report, e.g., 10,90,99 (the default).",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of files to process in parallel. Default 1.",
+    )
+    args = parser.parse_args()
+
+    tasks = [(path, args.group_by) for path in args.paths]
+    if args.jobs > 1:
+        with Pool(args.jobs) as pool:
+            results = pool.starmap(process_file, tasks)
+    else:
+        results = [process_file(*task) for task in tasks]
+
+    groups = {}
+    for result in results:
+        for key, group in result.items():
+            if key in groups:
+                merge_group(groups[key], group)
+            else:
+                groups[key] = group
+
+    for key in sorted(groups, key=json.dumps):
+        print(json.dumps(summarise(key, args.group_by, groups[key], args.percentiles)))
+
+
+if __name__ == "__main__":
+    main()
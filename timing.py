@@ -0,0 +1,98 @@
+"""
+Phase timing for golem.
+
+With --profile, golem records how long each phase of handling a
+request takes (parsing input, posting the HTTP request, decoding the
+response etc.), so that golem's own overhead can be told apart from
+time spent waiting for the API.
+"""
+
+import contextlib
+import math
+import sys
+import threading
+import time
+
+ENABLED = False  # Set by enable(), timing is a no-op otherwise
+
+_lock = threading.Lock()
+_phases = {}  # name -> [count, total seconds, max seconds, {log2 microsecond bucket: count}]
+
+
+def enable():
+    """
+    Start recording phase timings.
+    """
+    global ENABLED  # pylint: disable=global-statement
+    ENABLED = True
+
+
+def record(name, seconds):
+    """
+    Record the duration of one occurrence of a phase.
+    """
+    bucket = max(0, int(math.log2(seconds * 1e6))) if seconds > 0 else 0
+    with _lock:
+        stats = _phases.setdefault(name, [0, 0.0, 0.0, {}])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+        stats[3][bucket] = stats[3].get(bucket, 0) + 1
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Time the enclosed block as the named phase.
+    """
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def percentile(buckets, count, p):
+    """
+    Estimate a percentile, in seconds, from log2 microsecond buckets.
+    """
+    rank = p / 100 * count
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen >= rank:
+            return 2 ** (bucket + 1) / 1e6  # Upper bound of the bucket
+    return None
+
+
+def report(file=sys.stderr):
+    """
+    Print a summary of the phase timings.
+    """
+    with _lock:
+        phases = {name: list(stats) for name, stats in _phases.items()}
+
+    print(
+        f"{'phase':<10} {'count':>8} {'total s':>10} {'mean ms':>10} "
+        f"{'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}",
+        file=file,
+    )
+    for name, (count, total, longest, buckets) in phases.items():
+        print(
+            f"{name:<10} {count:>8} {total:>10.3f} {1000 * total / count:>10.3f} "
+            f"{1000 * min(percentile(buckets, count, 50), longest):>10.3f} "
+            f"{1000 * min(percentile(buckets, count, 99), longest):>10.3f} "
+            f"{1000 * longest:>10.3f}",
+            file=file,
+        )
+
+    if "ask" in phases:
+        # Whatever the API calls don't account for is golem building
+        # requests and handling responses.
+        other = phases["ask"][1] - sum(
+            phases[name][1] for name in ("post", "text", "decode", "backoff") if name in phases
+        )
+        print(f"ask time outside post/text/decode/backoff: {other:.3f} s", file=file)
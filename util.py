@@ -2,24 +2,89 @@
 Golem utilities
 """
 
-# pylint: disable=too-many-branches
+# pylint: disable=too-many-branches, too-many-statements, too-many-arguments
+# pylint: disable=too-many-positional-arguments
 
+from collections import deque
+import contextlib
 from datetime import datetime, timezone
 from decimal import Decimal
 from http import HTTPStatus
 import logging
 import os
+import queue
 import random
-import sys
+import threading
 import time
 import requests
 
-session = requests.Session()  # Use session for keep-alive and connection pooling
+import metrics
+import timing
+
+POOL_SIZE = 10  # Connections kept per host by default
+
+
+def new_session(size=POOL_SIZE):
+    """
+    Return a session, for keep-alive and connection pooling, keeping
+    up to size connections per host.
+    """
+    client = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size)
+    client.mount("https://", adapter)
+    client.mount("http://", adapter)
+    return client
+
+
+session = new_session()
+
+_context = threading.local()  # The session for this thread, see use_session
 
 MAX_RETRIES = 20  # Number of HTTP retries before giving up
 
 REDACTED = "REDACTED"  # Replacement text for credentials in output
 
+CHARS_PER_TOKEN = 4  # Rule of thumb for English text with BPE tokenizers
+
+CONNECT_TIMEOUT = 10  # Seconds to wait for a connection
+TIMEOUT_FLOOR = 30  # Minimum seconds to wait for a response
+TIMEOUT_CEILING = 600  # Maximum seconds to wait for a response
+TIMEOUT_SAFETY = 3  # Multiple of the expected response time to wait
+TIMEOUT_RETRY_FACTOR = 1.5  # Timeout growth on each retry
+PROMPT_TOKENS_PER_SECOND = 1000  # Conservative prompt processing rate
+OUTPUT_TOKENS_PER_SECOND = 10  # Conservative output rate, until observed
+RATE_WINDOW = 100  # Recent output rates kept per model
+RATE_MIN_SAMPLES = 5  # Rates needed before trusting them
+
+HEDGE_WINDOW = 1000  # Recent request latencies used to choose when to hedge
+HEDGE_MIN_SAMPLES = 20  # Latencies needed before hedging starts
+
+# Hedging policy and state, see enable_hedging
+hedging = {
+    "enabled": False,
+    "percentile": None,
+    "budget": None,
+    "url": None,
+    "latencies": {},  # (url, model) -> recent latencies
+    "requests": 0,
+    "hedges": 0,
+    "lock": threading.Lock(),
+}
+
+
+class GolemError(Exception):
+    """
+    A fatal error. The golem command exits with status 1, and library
+    callers can catch it.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
 
 class UnauthorizedException(Exception):
     """
@@ -47,6 +112,20 @@ def add_system_message(data, text):
     return data
 
 
+def estimate_tokens(messages):
+    """
+    Roughly estimate the number of prompt tokens in a list of
+    messages, without calling a tokenizer.
+    """
+    tokens = 0
+    for message in messages:
+        content = message.get("content")
+        if not isinstance(content, str):
+            content = str(content)
+        tokens += 4 + len(content) // CHARS_PER_TOKEN  # 4 for role and formatting
+    return tokens
+
+
 def decimal_range(start, stop, step):
     """
     Like range but not restricted to integers.
@@ -143,15 +222,22 @@ def lookup_variable(name):
 
 def fatal(text):
     """
-    Fatal error handler. Log the error, write to error.log, and bail.
+    Fatal error handler. Log the error and bail by raising GolemError.
+    The golem command records it in error.log.
     """
     logging.critical(text)
+    raise GolemError(text)
+
+
+def write_error_log(text):
+    """
+    Append a fatal error to error.log in the current directory.
+    """
     try:
         with open("error.log", "a", encoding="utf-8") as f:
             f.write(f"{timestamp()} FATAL: {text}\n")
     except IOError as e:
         logging.error("Failed to write to error.log: %s", e)
-    sys.exit(1)
 
 
 def is_rate_limited(response):
@@ -212,31 +298,255 @@ def reset_session():
     """Reset the global session by closing the existing one and creating a new one."""
     global session
     session.close()
-    session = requests.Session()
+    session = new_session()
+
+
+@contextlib.contextmanager
+def use_session(client):
+    """
+    Send this thread's requests with client, e.g., a session sized for
+    a run's concurrency, rather than the shared session.
+    """
+    previous = getattr(_context, "session", None)
+    _context.session = client
+    try:
+        yield client
+    finally:
+        _context.session = previous
+
+
+def attempt_seconds():
+    """
+    Return how long this thread's last HTTP request attempt took, from
+    sending it to reading the response, or None.
+    """
+    return getattr(_context, "attempt_seconds", None)
+
+
+def current_session():
+    """
+    Return the session for this thread's requests.
+    """
+    return getattr(_context, "session", None) or session
+
+
+# Recent output tokens per second, by model, for timeouts
+output_rates = {}
+output_rates_lock = threading.Lock()
+
+
+def record_output_rate(model, tokens, seconds):
+    """
+    Record the output tokens per second of a response from a model.
+    """
+    if tokens and seconds > 0:
+        with output_rates_lock:
+            if model not in output_rates:
+                output_rates[model] = deque(maxlen=RATE_WINDOW)
+            output_rates[model].append(tokens / seconds)
+
+
+def output_rate(model):
+    """
+    Return a pessimistic (slowest decile) recent output rate for a
+    model, in tokens per second.
+    """
+    with output_rates_lock:
+        rates = sorted(output_rates.get(model, ()))
+    if len(rates) < RATE_MIN_SAMPLES:
+        return OUTPUT_TOKENS_PER_SECOND
+    return rates[len(rates) // 10]
+
+
+def adaptive_timeout(
+    model, messages, max_tokens, floor=TIMEOUT_FLOOR, ceiling=TIMEOUT_CEILING
+):
+    """
+    Return (connect, read) timeouts for a request, allowing a multiple
+    of the time expected to process the prompt and generate max_tokens,
+    clamped between floor and ceiling. Without max_tokens the output
+    length is unknown, so the read timeout is the ceiling.
+    """
+    if max_tokens is None:
+        return CONNECT_TIMEOUT, ceiling
+    expected = (
+        estimate_tokens(messages) / PROMPT_TOKENS_PER_SECOND
+        + max_tokens / output_rate(model)
+    )
+    return CONNECT_TIMEOUT, min(max(floor, TIMEOUT_SAFETY * expected), ceiling)
+
+
+def retry_timeout(timeout, ceiling=TIMEOUT_CEILING):
+    """
+    Return a longer timeout for a retry, in case the last attempt
+    timed out, growing up to ceiling (or the original timeout if that
+    was longer).
+    """
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+    else:
+        connect, read = timeout, timeout
+    return connect, min(read * TIMEOUT_RETRY_FACTOR, max(read, ceiling))
 
 
-def http_request(url, headers, json_data, retry=0, timeout=600):
+def enable_hedging(percentile, budget, url=None):
     """
-    Make an HTTP request to an LLM API
+    Hedge requests: when a request has taken longer than the given
+    percentile of recent latencies, send a duplicate (to url if given)
+    and use whichever answers first. Duplicates are limited to budget
+    percent of requests.
     """
+    hedging["enabled"] = True
+    hedging["percentile"] = percentile
+    hedging["budget"] = budget
+    hedging["url"] = url
+
+
+def hedge_delay(key, first=True):
+    """
+    Return how long to wait before hedging a request to key, a (url,
+    model) pair, or None if it should not be hedged. Only first
+    attempts, not retries, count towards the budget.
+    """
+    with hedging["lock"]:
+        if first:
+            hedging["requests"] += 1
+        latencies = sorted(hedging["latencies"].get(key, ()))
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        if hedging["hedges"] + 1 > hedging["budget"] / 100 * hedging["requests"]:
+            return None
+        index = min(int(hedging["percentile"] / 100 * len(latencies)), len(latencies) - 1)
+        return latencies[index]
+
+
+def record_latency(key, seconds):
+    """
+    Record the latency of a successful request to key, a (url, model)
+    pair, for hedging.
+    """
+    with hedging["lock"]:
+        if key not in hedging["latencies"]:
+            hedging["latencies"][key] = deque(maxlen=HEDGE_WINDOW)
+        hedging["latencies"][key].append(seconds)
+
+
+def post(client, url, headers, json_data, timeout):
+    """
+    Post a request and read the response, returning the response or
+    the exception raised, for the thread waiting on it to raise.
+    """
+    try:
+        response = client.post(url, headers=headers, json=json_data, timeout=timeout)
+        _ = response.text
+        return response
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return e
+
+
+def hedged_post(url, headers, json_data, timeout, delay):
+    """
+    Post a request and, if it hasn't answered after delay seconds,
+    post a duplicate on a session of its own. Return the first good
+    response. The loser can't be interrupted, so it runs on until it
+    answers or times out, and its response is ignored.
+    """
+    done = queue.Queue()
+    original = current_session()
+    # Neither post can take longer than this, as both time out
+    wait = sum(timeout) if isinstance(timeout, tuple) else timeout
+
+    def send(name, client, target):
+        response = requests.Timeout(f"No response from the {name} request")
+        try:
+            response = post(client, target, headers, json_data, timeout)
+        finally:
+            done.put((name, response))
+            if client is not original:
+                client.close()
+
+    def first_response():
+        try:
+            return done.get(timeout=wait)
+        except queue.Empty:
+            return None, requests.Timeout("No response from the hedged requests")
+
+    threading.Thread(
+        target=send, args=("original", original, url), daemon=True
+    ).start()
+    try:
+        _, response = done.get(timeout=delay)
+    except queue.Empty:
+        with hedging["lock"]:
+            hedging["hedges"] += 1
+        metrics.inc("golem_hedged_requests_total", **metrics.labels())
+        logging.debug("Hedging after %.3f s", delay)
+
+        hedge = new_session()
+        threading.Thread(
+            target=send, args=("hedge", hedge, hedging["url"] or url), daemon=True
+        ).start()
+
+        name, response = first_response()
+        if name is not None and (
+            isinstance(response, Exception) or is_continuable_error(response)
+        ):
+            # The first to finish failed, so wait for the other
+            name, response = first_response()
+
+        if name == "hedge":
+            metrics.inc("golem_hedge_wins_total", **metrics.labels())
+
+    if isinstance(response, Exception):
+        raise response
+    return response
+
+
+def http_request(url, headers, json_data, retry=0, timeout=None, timeout_ceiling=None):
+    """
+    Make an HTTP request to an LLM API. The timeout is in seconds, or
+    a (connect, read) tuple. Retries wait longer, up to timeout_ceiling.
+    Both default to TIMEOUT_CEILING.
+    """
+
+    if timeout_ceiling is None:
+        timeout_ceiling = TIMEOUT_CEILING
+    if timeout is None:
+        timeout = timeout_ceiling
 
     logging.debug(
-        "http_request: {{url: %s, headers: %s, json: %s, retry: %s}}",
+        "http_request: {{url: %s, headers: %s, json: %s, retry: %s, timeout: %s}}",
         url,
         headers,
         json_data,
         retry,
+        timeout,
     )
 
     try:
-        response = session.post(url, headers=headers, json=json_data, timeout=timeout)
+        key = (url, json_data.get("model"))
+        delay = hedge_delay(key, retry == 0) if hedging["enabled"] else None
+        start = time.monotonic()
+        with timing.phase("post"):
+            if delay is None:
+                response = current_session().post(
+                    url, headers=headers, json=json_data, timeout=timeout
+                )
+            else:
+                response = hedged_post(url, headers, json_data, timeout, delay)
+        with timing.phase("text"):
+            text = response.text
+        # Retries overwrite this, so it times the attempt that answered
+        _context.attempt_seconds = time.monotonic() - start
+        if hedging["enabled"] and response.status_code == HTTPStatus.OK:
+            record_latency(key, time.monotonic() - start)
         logging.debug(
             "http_response: {{status_code: %s, headers: %s, text: %s}}",
             response.status_code,
             response.headers,
-            response.text,
+            text,
         )
-        if response.text.strip() == "":
+        if text.strip() == "":
             # Seen with DeepSeek behind Cloudflare
             logging.warning("Empty response.text, ignoring.")
             response = None
@@ -246,7 +556,14 @@ def http_request(url, headers, json_data, retry=0, timeout=600):
         response = None
 
     if response is None:
-        reset_session()
+        # Other threads may be using a session from use_session, and
+        # its pool discards broken connections anyway
+        if current_session() is session:
+            reset_session()
+        status_class = "error"
+    else:
+        status_class = f"{response.status_code // 100}xx"
+    metrics.inc("golem_http_responses_total", status_class=status_class, **metrics.labels())
 
     if is_continuable_error(response):
 
@@ -267,8 +584,18 @@ def http_request(url, headers, json_data, retry=0, timeout=600):
                     int(d),
                     retry,
                 )
-            time.sleep(d)
-            _, response = http_request(url, headers, json_data, retry)
+            metrics.inc("golem_retries_total", **metrics.labels())
+            metrics.inc("golem_backoff_seconds_total", d, **metrics.labels())
+            with timing.phase("backoff"):
+                time.sleep(d)
+            _, response = http_request(
+                url,
+                headers,
+                json_data,
+                retry,
+                retry_timeout(timeout, timeout_ceiling),
+                timeout_ceiling,
+            )
     elif response.status_code == HTTPStatus.OK:
         pass
     elif response.status_code == HTTPStatus.UNAUTHORIZED:
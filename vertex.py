@@ -7,7 +7,9 @@ Google Vertex support for Golem
 import subprocess
 import logging
 
-from util import http_request, fatal, lookup_variable, UnauthorizedException
+from registry import DEFAULT_MODELS
+from util import http_request, fatal, GolemError, lookup_variable, UnauthorizedException
+from timing import phase
 
 API_KEY_CACHE = None  # API key cache
 
@@ -26,7 +28,16 @@ def get_google_token():
         return None
 
 
-def ask_google(model, messages, temperature, seed, top_p, max_tokens):
+def ask_google(
+    model,
+    messages,
+    temperature,
+    seed,
+    top_p,
+    max_tokens,
+    timeout=None,
+    timeout_ceiling=None,
+):
     """
     Make a request to the Google Vertex API.
     """
@@ -53,7 +64,7 @@ def ask_google(model, messages, temperature, seed, top_p, max_tokens):
     project_id = lookup_variable("CLOUDSDK_CORE_PROJECT")
 
     if model is None:
-        model = "gemini-1.5-flash-001"  # Default
+        model = DEFAULT_MODELS["google"]  # Default
 
     global API_KEY_CACHE
     if API_KEY_CACHE is None:
@@ -112,18 +123,33 @@ def ask_google(model, messages, temperature, seed, top_p, max_tokens):
     try:
         try:
             logging.debug(json_data)
-            request, response = http_request(url, headers, json_data)
+            request, response = http_request(
+                url,
+                headers,
+                json_data,
+                timeout=timeout,
+                timeout_ceiling=timeout_ceiling,
+            )
         except UnauthorizedException:
             # Re-authenticate and try again
             API_KEY_CACHE = get_google_token()
             headers["Authorization"] = f"Bearer {API_KEY_CACHE}"
-            request, response = http_request(url, headers, json_data)
-
-        response = response.json()
+            request, response = http_request(
+                url,
+                headers,
+                json_data,
+                timeout=timeout,
+                timeout_ceiling=timeout_ceiling,
+            )
+
+        with phase("decode"):
+            response = response.json()
         answer = response["candidates"][0]["content"]["parts"][0]["text"]
         provider = "google"
         # The Google Vertex API does not respond with the model name, so
         # we just have to trust that it used the model that we asked for.
+    except GolemError:
+        raise
     except Exception as e:
         fatal(f"EXCEPTION: {e} REQUEST: {request} RESPONSE: {response}")
 
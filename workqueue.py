@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+"""
+A shared, on-disk work queue for golem, so that several golem
+processes can drain one sweep (see golem --queue).
+
+The queue is a SQLite database of work items. Workers lease one item
+at a time; a lease that is not completed in time, e.g., because the
+worker crashed, expires and the item is leased again.
+
+Usage: workqueue.py queue.db
+Prints the number of pending, leased and done work items.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+from schedule import work_key
+
+LEASE_SECONDS = 3600  # Default time a worker has to complete an item
+POLL_SECONDS = 10  # How often an idle worker checks for expired leases
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS items_state_seq ON items (state, seq);
+"""
+
+
+def connect(path):
+    """
+    Open (creating if necessary) a work queue.
+    """
+    # Transactions are managed explicitly, and a generous timeout
+    # lets workers wait for each other's locks.
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def worker_name():
+    """
+    Return a name for this worker process.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def item_key(item):
+    """
+    Return the queue key of a work item.
+    """
+    return work_key(item["id"], item["repeat"], item["temperature"], item["top_p"])
+
+
+def enqueue(conn, items):
+    """
+    Add work items to the queue. Items that are already queued, in
+    whatever state, are left alone, so every worker can safely
+    enqueue the same sweep.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO items (key, seq, item) VALUES (?, ?, ?)",
+            (
+                (item_key(item), seq, json.dumps(item, default=float))
+                for seq, item in enumerate(items)
+            ),
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    logging.info("Queued %s new work items", conn.total_changes - before)
+
+
+def lease(conn, worker, lease_seconds=LEASE_SECONDS):
+    """
+    Lease the next work item, or return None if there is nothing left
+    to do.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Expired leases first, so crashed workers' items are retried
+        row = conn.execute(
+            "SELECT key, item FROM items WHERE state = 'leased' AND lease_until < ? "
+            "ORDER BY seq LIMIT 1",
+            (now,),
+        ).fetchone()
+        if row is None:
+            row = conn.execute(
+                "SELECT key, item FROM items WHERE state = 'pending' ORDER BY seq LIMIT 1"
+            ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE items SET state = 'leased', worker = ?, lease_until = ?, "
+                "attempts = attempts + 1 WHERE key = ?",
+                (worker, now + lease_seconds, row[0]),
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    if row is None:
+        return None
+    item = json.loads(row[1])
+    item["queue_key"] = row[0]
+    return item
+
+
+def complete(conn, item):
+    """
+    Mark a leased work item as done.
+    """
+    conn.execute(
+        "UPDATE items SET state = 'done', lease_until = NULL WHERE key = ?",
+        (item["queue_key"],),
+    )
+
+
+def other_leases(conn, worker):
+    """
+    Return when the first lease held by another worker expires, or
+    None if no other worker holds a lease.
+    """
+    return conn.execute(
+        "SELECT MIN(lease_until) FROM items WHERE state = 'leased' AND worker != ?",
+        (worker,),
+    ).fetchone()[0]
+
+
+def leased_items(conn, lease_seconds=LEASE_SECONDS):
+    """
+    Generate work items leased from the queue until it is drained.
+    Callers should complete() each item once its result is written.
+    While other workers hold leases, keep polling, so that the items
+    of a worker that crashed are leased again when they expire. This
+    worker's own leases are left to the caller to complete.
+    """
+    worker = worker_name()
+    while True:
+        item = lease(conn, worker, lease_seconds)
+        if item is not None:
+            yield item
+            continue
+
+        expiry = other_leases(conn, worker)
+        if expiry is None:
+            logging.info("Work queue drained: %s", status(conn))
+            return
+        logging.debug("Waiting for other workers: %s", status(conn))
+        time.sleep(min(POLL_SECONDS, max(expiry - time.time(), 0) + 0.1))
+
+
+def status(conn):
+    """
+    Return the number of work items in each state.
+    """
+    counts = {"pending": 0, "leased": 0, "done": 0}
+    for state, count in conn.execute("SELECT state, COUNT(*) FROM items GROUP BY state"):
+        counts[state] = count
+    return counts
+
+
+def main():
+    """
+    Print the status of a queue.
+    """
+    if len(sys.argv) != 2:
+        print("Usage: workqueue.py queue.db", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(status(connect(sys.argv[1]))))
+
+
+if __name__ == "__main__":
+    main()